@@ -0,0 +1,178 @@
+import argparse
+import pathlib
+import sys
+import time
+from multiprocessing import Pool
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+from transparency import STRATEGIES, ImageFileError, SaveOptions
+from transparency import read_image, write_image, to_bgra, apply_alpha
+from stream import save_streaming
+
+
+class Rect(NamedTuple):
+
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+    def select(self, mask):
+        """Select the rectangle including its right and bottom edges
+           like Window.draw does.
+        """
+        mask[self.y0: self.y1 + 1, self.x0: self.x1 + 1] = True
+
+
+class Job(NamedTuple):
+
+    src: pathlib.Path
+    dest: pathlib.Path
+    rects: list
+    mask_file: pathlib.Path = None
+
+
+class Result(NamedTuple):
+
+    src: pathlib.Path
+    elapsed: float
+    pixels: int = 0
+    error: str = None
+
+
+def read_mask(file_path, shape):
+    """Read the mask file in which nonzero pixels are selected.
+    """
+    if (img := cv2.imread(str(file_path), cv2.IMREAD_GRAYSCALE)) is None:
+        raise ImageFileError(f"Can't open/read mask file: {file_path}")
+
+    if img.shape != shape:
+        raise ImageFileError(f'Mask size {img.shape} does not match image size {shape}: {file_path}')
+
+    return img > 0
+
+
+def make_mask(job, shape):
+    if job.mask_file:
+        mask = read_mask(job.mask_file, shape)
+    else:
+        mask = np.zeros(shape, dtype=bool)
+
+    for rect in job.rects:
+        rect.select(mask)
+
+    return mask
+
+
+def process(job, alpha, options, stream):
+    start = time.perf_counter()
+
+    try:
+        img, _ = read_image(job.src)
+        mask = make_mask(job, img.shape[:2])
+
+        if stream:
+            save_streaming(job.dest, img, mask, alpha, options)
+        else:
+            # Memory-mapped .npy files are read-only.
+            if img.shape[2] == 3 or not img.flags.writeable:
+                img = to_bgra(img)
+
+            apply_alpha(img, mask, alpha)
+            write_image(job.dest, img, options)
+    except (ImageFileError, OSError) as e:
+        return Result(job.src, time.perf_counter() - start, error=str(e))
+
+    return Result(job.src, time.perf_counter() - start, img.shape[0] * img.shape[1])
+
+
+def _process(args):
+    return process(*args)
+
+
+def collect_jobs(input_dir, output_dir, pattern, rects, mask, mask_dir, suffix='.png'):
+    jobs = []
+
+    for src in sorted(input_dir.glob(pattern)):
+        if mask_dir:
+            if not (mask_file := mask_dir / src.name).exists():
+                print(f'skip {src.name}: no mask file in {mask_dir}', file=sys.stderr)
+                continue
+        else:
+            mask_file = mask
+
+        dest = output_dir / src.with_suffix(suffix).name
+        jobs.append(Job(src, dest, rects, mask_file))
+
+    return jobs
+
+
+def run(jobs, alpha, options, workers, stream):
+    start = time.perf_counter()
+    pixels = 0
+    errors = 0
+
+    with Pool(workers) as pool:
+        for result in pool.imap_unordered(_process, [(job, alpha, options, stream) for job in jobs]):
+            if result.error:
+                errors += 1
+                print(f'{result.src.name}: error {result.error}', file=sys.stderr)
+            else:
+                pixels += result.pixels
+                print(f'{result.src.name}: {result.elapsed:.3f} s')
+
+    total = time.perf_counter() - start
+    done = len(jobs) - errors
+    print(f'{done} files ({errors} errors) in {total:.3f} s: '
+          f'{done / total:.2f} files/s, {pixels / total / 1e6:.2f} Mpx/s')
+
+    return errors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Make the images in a directory partially transparent.')
+    parser.add_argument('input_dir', type=pathlib.Path)
+    parser.add_argument('output_dir', type=pathlib.Path)
+    parser.add_argument(
+        '--rect', type=int, nargs=4, action='append', default=[], metavar=('X0', 'Y0', 'X1', 'Y1'),
+        help='area to make transparent; can be repeated')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--mask', type=pathlib.Path, help='mask image applied to all the files')
+    group.add_argument('--mask-dir', type=pathlib.Path, help='directory of mask images having the same names')
+    parser.add_argument('--alpha', type=int, default=50, help='from 0 to 255')
+    parser.add_argument('--pattern', default='*.png')
+    parser.add_argument(
+        '--format', choices=['png', 'tif', 'npy'], default='png', help='tif and npy are written uncompressed')
+    parser.add_argument(
+        '--compression', type=int, choices=range(10), help='PNG compression level; defaults to OpenCV default')
+    parser.add_argument('--strategy', choices=STRATEGIES, help='PNG compression strategy; defaults to OpenCV default')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of CPUs')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='save in row bands; memory stays bounded for .npy inputs, which are memory-mapped')
+    args = parser.parse_args()
+
+    if not (args.rect or args.mask or args.mask_dir):
+        parser.error('one of --rect, --mask or --mask-dir is required')
+
+    if args.stream and args.format == 'tif':
+        parser.error('tif cannot be saved with --stream')
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rects = [Rect(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)) for x0, y0, x1, y1 in args.rect]
+    alpha = min(max(args.alpha, 0), 255)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    options = SaveOptions(args.compression, args.strategy)
+
+    jobs = collect_jobs(
+        args.input_dir, args.output_dir, args.pattern, rects, args.mask, args.mask_dir, f'.{args.format}')
+    sys.exit(1 if run(jobs, alpha, options, args.workers, args.stream) else 0)
@@ -0,0 +1,263 @@
+import argparse
+import pathlib
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from transparency import MARKER_COLOR, STRATEGIES, SaveOptions, apply_alpha, overlay, to_bgra, write_image
+from viewport import Viewport
+
+
+SIZES = {'1K': 1024, '4K': 4096, '16K': 16384}
+
+
+def apply_alpha_loop(img_org, img_cvt, alpha):
+    """The per-pixel loop formerly used in Window.save_image.
+    """
+    rows, cols = img_org.shape[:2]
+
+    for i in range(rows):
+        for j in range(cols):
+            arr = img_cvt[i, j]
+            if arr[0] == 0 and arr[1] == 255 and arr[2] == 0:
+                img_org[i, j][3] = alpha
+
+
+def make_images(n, seed=0):
+    """Return a random BGRA image, the selection mask having about 10% of
+       the area selected in several rectangles and the RGB copy on which
+       the selection is painted with the marker color.
+    """
+    rng = np.random.default_rng(seed)
+    img_org = rng.integers(0, 256, size=(n, n, 4), dtype=np.uint8)
+    img_org[..., 3] = 255
+    mask = np.zeros((n, n), dtype=bool)
+
+    for _ in range(10):
+        y, x = rng.integers(0, n, size=2)
+        h, w = max(1, n // 10), max(1, n // 10)
+        mask[y: y + h, x: x + w] = True
+
+    img_cvt = overlay(img_org[..., :3], mask)
+    return img_org, mask, img_cvt
+
+
+def apply_alpha_marker(img_org, img_cvt, alpha):
+    """Rediscover the selection by scanning the marker color, then apply alpha.
+    """
+    r, g, b = MARKER_COLOR
+    mask = (img_cvt[..., 0] == r) & (img_cvt[..., 1] == g) & (img_cvt[..., 2] == b)
+    apply_alpha(img_org, mask, alpha)
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run_save(labels, alpha, max_loop_rows):
+    print(f'{"size":>5} {"loop [s]":>12} {"marker [s]":>12} {"mask [s]":>12} {"speedup":>9}  identical  stray')
+
+    for label in labels:
+        n = SIZES[label]
+        img_org, mask, img_cvt = make_images(n)
+
+        # The loop is too slow for large images, so it is run on the top rows
+        # and the elapsed time is extrapolated to the whole image.
+        rows = min(n, max_loop_rows)
+        loop_org = img_org[:rows].copy()
+        loop_time = measure(apply_alpha_loop, loop_org, img_cvt[:rows], alpha) * n / rows
+
+        marker_org = img_org.copy()
+        marker_time = measure(apply_alpha_marker, marker_org, img_cvt, alpha)
+
+        mask_org = img_org.copy()
+        mask_time = measure(apply_alpha, mask_org, mask, alpha)
+
+        # The marker scan gives the same output as the loop, but it also picks up
+        # the pixels which are pure green in the source (stray).
+        identical = np.array_equal(loop_org, marker_org[:rows])
+        stray = np.count_nonzero(marker_org[..., 3] != mask_org[..., 3])
+        note = '' if rows == n else f' (loop extrapolated from {rows} rows)'
+        print(f'{label:>5} {loop_time:>12.3f} {marker_time:>12.4f} {mask_time:>12.4f} '
+              f'{loop_time / mask_time:>8.0f}x  {str(identical):>9}  {stray:>5}{note}')
+
+
+def save_insert(img_org, mask, alpha, buffer):
+    """Build the output like Window.save_image formerly did.
+    """
+    img = np.insert(img_org, 3, 255, axis=2)
+    img[mask, 3] = alpha
+    return img
+
+
+def save_buffer(img_org, mask, alpha, buffer):
+    """Build the output into the reused buffer like Window.save_image does.
+    """
+    img = to_bgra(img_org, buffer)
+    apply_alpha(img, mask, alpha)
+    return img
+
+
+def measure_peak(func, *args):
+    """Return the elapsed time and the peak memory allocated by func.
+       Memory allocated inside OpenCV is not traced.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run_memory(labels, alpha):
+    print(f'{"size":>5} {"method":>7} {"time [s]":>10} {"peak [MB]":>10} {"peak / image":>13}')
+
+    for label in labels:
+        n = SIZES[label]
+        img_org, mask, _ = make_images(n)
+        img_org = np.ascontiguousarray(img_org[..., :3])
+        buffer = to_bgra(img_org)
+        size = buffer.nbytes
+
+        # The first save allocates the buffer, and the later saves reuse it.
+        for name, func, buf in [('insert', save_insert, None), ('first', save_buffer, None),
+                                ('reuse', save_buffer, buffer)]:
+            elapsed, peak = measure_peak(func, img_org, mask, alpha, buf)
+            print(f'{label:>5} {name:>7} {elapsed:>10.3f} {peak / 1024 ** 2:>10.1f} {peak / size:>13.2f}')
+
+
+ENCODE_SETTINGS = [
+    ('png', SaveOptions()),
+    *[('png', SaveOptions(level)) for level in (0, 1, 3, 6, 9)],
+    *[('png', SaveOptions(1, strategy)) for strategy in STRATEGIES],
+    ('tif', SaveOptions()),
+    ('npy', SaveOptions()),
+]
+
+
+def load_heightfield(file_path, size):
+    """Read the heightfield keeping its bit depth, and resize it to size x size
+       so that it stays smooth like real heightfields.
+    """
+    img = cv2.imread(str(file_path), cv2.IMREAD_UNCHANGED)
+
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_CUBIC)
+    return to_bgra(img)
+
+
+def run_encode(file_path, size, repeat):
+    img = load_heightfield(file_path, size)
+    print(f'{file_path.name} resized to {size}x{size}, {img.dtype}, {img.nbytes / 1024 ** 2:.1f} MB')
+    print(f'{"format":>6} {"level":>7} {"strategy":>12} {"time [s]":>10} {"size [MB]":>10}')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for suffix, options in ENCODE_SETTINGS:
+            out_path = pathlib.Path(temp_dir) / f'out.{suffix}'
+            elapsed = statistics.median(
+                measure(write_image, out_path, img, options) for _ in range(repeat))
+            level = 'opencv' if options.compression is None else options.compression
+            strategy = options.strategy or 'opencv'
+            file_size = out_path.stat().st_size / 1024 ** 2
+            print(f'{suffix:>6} {level:>7} {strategy:>12} {elapsed:>10.3f} {file_size:>10.2f}')
+
+
+def set_source(viewport, img_org, mask):
+    """Make the viewport get regions from img_org and mask like Window does.
+    """
+    def get_region(x0, y0, x1, y1):
+        region = np.s_[y0: y1, x0: x1]
+        return Image.fromarray(overlay(img_org[region], mask[region]))
+
+    rows, cols = mask.shape
+    viewport.set_source(get_region, cols, rows, 'RGB')
+
+
+def edit_full(img_org, mask, viewport, rect, view):
+    """Refresh the whole image after an edit like Window.draw formerly did.
+    """
+    x0, y0, x1, y1 = rect
+    mask[y0: y1 + 1, x0: x1 + 1] = True
+    img_pil = Image.fromarray(overlay(img_org, mask))
+    rows, cols = mask.shape
+    viewport.set_source(lambda *box: img_pil.crop(box), cols, rows, 'RGB')
+    viewport.render(*view)
+
+
+def edit_incremental(img_org, mask, viewport, rect, view):
+    """Refresh only the changed region after an edit like Window.draw does.
+    """
+    x0, y0, x1, y1 = rect
+    mask[y0: y1 + 1, x0: x1 + 1] = True
+    viewport.update(x0, y0, x1 + 1, y1 + 1)
+    viewport.render(*view)
+
+
+def run_edit(labels, repeat, canvas_size=(600, 400)):
+    print(f'{"size":>5} {"edit":>6} {"full [ms]":>12} {"incremental [ms]":>17} {"speedup":>9}')
+
+    for label in labels:
+        n = SIZES[label]
+        img_org = make_images(n)[0][..., :3]
+        view = (n, n, 0, 0, *canvas_size)
+        edits = {'1px': (0, 0, 0, 0), '1%': (0, 0, n // 10 - 1, n // 10 - 1), '100%': (0, 0, n - 1, n - 1)}
+
+        for name, rect in edits.items():
+            times = {}
+
+            for func in (edit_full, edit_incremental):
+                mask = np.zeros((n, n), dtype=bool)
+                viewport = Viewport()
+                set_source(viewport, img_org, mask)
+                viewport.render(*view)
+                times[func] = statistics.median(
+                    measure(func, img_org, mask, viewport, rect, view) for _ in range(repeat))
+
+            full, incremental = times[edit_full] * 1000, times[edit_incremental] * 1000
+            print(f'{label:>5} {name:>6} {full:>12.2f} {incremental:>17.2f} {full / incremental:>8.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the image editor.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    save_parser = subparsers.add_parser('save', help='compare the ways of applying alpha on save')
+    save_parser.add_argument('--sizes', nargs='+', choices=SIZES, default=list(SIZES))
+    save_parser.add_argument('--alpha', type=int, default=50)
+    save_parser.add_argument('--max-loop-rows', type=int, default=256)
+
+    memory_parser = subparsers.add_parser('memory', help='compare the peak memory of building the output on save')
+    memory_parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['1K', '4K'])
+    memory_parser.add_argument('--alpha', type=int, default=50)
+
+    encode_parser = subparsers.add_parser('encode', help='compare encode time and file size of save options')
+    encode_parser.add_argument(
+        '--image', type=pathlib.Path,
+        default=pathlib.Path(__file__).parents[1] / 'invisible_triangle/terrain/sample_2.png')
+    encode_parser.add_argument('--size', type=int, default=2048)
+    encode_parser.add_argument('--repeat', type=int, default=3)
+
+    edit_parser = subparsers.add_parser('edit', help='compare the latency of refreshing display after edits')
+    edit_parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['1K', '4K'])
+    edit_parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == 'save':
+        run_save(args.sizes, args.alpha, args.max_loop_rows)
+    elif args.command == 'memory':
+        run_memory(args.sizes, args.alpha)
+    elif args.command == 'encode':
+        run_encode(args.image, args.size, args.repeat)
+    else:
+        run_edit(args.sizes, args.repeat)
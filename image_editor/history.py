@@ -0,0 +1,129 @@
+from collections import deque
+from typing import NamedTuple
+
+import numpy as np
+
+
+# The maximum memory (bytes) used by the history.
+HISTORY_CAPACITY = 64 * 1024 ** 2
+
+
+class Entry(NamedTuple):
+    """The mask bits of the rectangle (x0, y0)-(x1, y1), both edges
+       included, packed into 1 bit per pixel.
+    """
+
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    bits: np.ndarray
+
+    @property
+    def region(self):
+        return np.s_[self.y0: self.y1 + 1, self.x0: self.x1 + 1]
+
+    @property
+    def rect(self):
+        return self.x0, self.y0, self.x1, self.y1
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    @classmethod
+    def from_mask(cls, mask, x0, y0, x1, y1):
+        bits = np.packbits(mask[y0: y1 + 1, x0: x1 + 1], axis=None)
+        return cls(x0, y0, x1, y1, bits)
+
+    def swap(self, mask):
+        """Restore the bits to the mask and return the entry having the bits
+           which were in the mask.
+        """
+        region = self.region
+        current = Entry.from_mask(mask, *self.rect)
+        shape = mask[region].shape
+        mask[region] = np.unpackbits(self.bits, count=shape[0] * shape[1]).reshape(shape)
+        return current
+
+
+class Group(NamedTuple):
+    """The entries of the segments of a stroke, undone and redone at once.
+    """
+
+    entries: list
+
+    @property
+    def rect(self):
+        x0s, y0s, x1s, y1s = zip(*(entry.rect for entry in self.entries))
+        return min(x0s), min(y0s), max(x1s), max(y1s)
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self.entries)
+
+    def swap(self, mask):
+        """Restore the entries from the last one, and return the group which
+           restores the swapped bits from the first one.
+        """
+        return Group([entry.swap(mask) for entry in reversed(self.entries)])
+
+
+class History:
+    """Undo/redo history of the selection mask. Each entry stores only the
+       bits of the changed rectangle. When the memory exceeds the capacity,
+       the oldest entries are discarded.
+    Args:
+        capacity (int): the maximum memory (bytes) used by the entries.
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+
+    def record(self, mask, x0, y0, x1, y1, merge=False):
+        """Call before changing the rectangle of the mask. If merge is True,
+           the entry is merged into the last one, like the segments of a stroke.
+        """
+        for entry in self.redo_stack:
+            self.nbytes -= entry.nbytes
+        self.redo_stack.clear()
+
+        entry = Entry.from_mask(mask, x0, y0, x1, y1)
+        self.nbytes += entry.nbytes
+
+        if merge and self.undo_stack:
+            if not isinstance(last := self.undo_stack[-1], Group):
+                last = self.undo_stack[-1] = Group([last])
+            last.entries.append(entry)
+        else:
+            self.undo_stack.append(entry)
+
+        while self.nbytes > self.capacity and self.undo_stack:
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+    def _move(self, mask, src, dest):
+        if not src:
+            return None
+
+        entry = src.pop()
+        dest.append(swapped := entry.swap(mask))
+        self.nbytes += swapped.nbytes - entry.nbytes
+        return entry.rect
+
+    def undo(self, mask):
+        """Return the restored rectangle, or None if there is nothing to undo.
+        """
+        return self._move(mask, self.undo_stack, self.redo_stack)
+
+    def redo(self, mask):
+        """Return the restored rectangle, or None if there is nothing to redo.
+        """
+        return self._move(mask, self.redo_stack, self.undo_stack)
@@ -1,16 +1,24 @@
 import pathlib
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 import tkinter.ttk as ttk
 from tkinter import messagebox, filedialog
 from typing import NamedTuple
 
-import cv2
 import numpy as np
 from PIL import Image, ImageTk
 
+from transparency import STRATEGIES, ImageFileError, SaveOptions
+from transparency import read_image, write_image, to_bgra, apply_alpha, overlay
+from viewport import Viewport
+from history import History
+from stream import save_streaming
+from selection import select_range, segment_rect, paint_segment, polygon_rect, fill_polygon
+from jobs import Cancelled, JobState
 
-class ImageFileError(Exception):
-    pass
+
+# The interval (ms) at which the mainloop checks the job on the worker thread.
+POLL_INTERVAL = 50
 
 
 class Size(NamedTuple):
@@ -50,16 +58,36 @@ class Window(ttk.Frame):
         super().__init__(master)
         self.master.geometry('600x400')
         self.pack(fill=tk.BOTH, expand=True)
-        self.master.bind('<Escape>', lambda event: self.master.destroy())
+        self.master.bind('<Escape>', lambda event: self.close())
 
         self.start_pt = None
         self.default_alpha = 50
         self.img_tk = None
+        self.save_buffer = None
         self.rect_tag = 'temp_rect'
         self.is_edit = False
+        # If True, the pixels in the height range are selected instead of rectangles.
+        self.auto_select_var = tk.BooleanVar(value=False)
+        # rectangle, brush or lasso
+        self.tool_var = tk.StringVar(value='rectangle')
+        self.tool = None
+        self.last_pt = None
+        self.lasso_pts = []
+        self.stroke_recorded = False
+        self.viewport = Viewport()
+        self.history = History()
+        # Open and save run on the worker thread so that the mainloop never blocks.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.job = None
 
         self.create_ui()
 
+    def close(self):
+        # The worker thread stops at the next step of the job.
+        self.cancel_job()
+        self.executor.shutdown(wait=False)
+        self.master.destroy()
+
     def create_ui(self):
         self.create_display_area()
         self.create_widget_area()
@@ -68,9 +96,21 @@ class Window(ttk.Frame):
     def create_display_area(self):
         frame = ttk.Frame(self, relief=tk.SUNKEN)
         frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        self.canvas = tk.Canvas(frame, bg='#D3D3D3')
-        self.canvas.pack(fill=tk.BOTH, expand=True)
+        frame.rowconfigure(0, weight=1)
+        frame.columnconfigure(0, weight=1)
+
+        self.canvas = tk.Canvas(frame, bg='#D3D3D3', scrollregion=(0, 0, 0, 0))
+        self.canvas.grid(row=0, column=0, sticky=tk.NSEW)
 
+        # Only the visible region is rendered, so the scrollbars move the view
+        # and render it again instead of scrolling a whole image.
+        x_scrollbar = ttk.Scrollbar(frame, orient=tk.HORIZONTAL, command=self.scroll_x)
+        x_scrollbar.grid(row=1, column=0, sticky=tk.EW)
+        y_scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.scroll_y)
+        y_scrollbar.grid(row=0, column=1, sticky=tk.NS)
+        self.canvas.configure(xscrollcommand=x_scrollbar.set, yscrollcommand=y_scrollbar.set)
+
+        self.canvas.bind('<Configure>', lambda event: self.resize_img(self.var_scale.get()))
         self.canvas.bind('<Button-1>', self.mouse_click)
         self.canvas.bind('<Button1-Motion>', self.mouse_drag)
         self.canvas.bind('<ButtonRelease-1>', self.mouse_release)
@@ -104,6 +144,35 @@ class Window(ttk.Frame):
         )
         alpha_entry.pack(side=tk.LEFT, padx=(2, 10))
 
+        label = ttk.Label(frame, text='range')
+        label.pack(side=tk.LEFT, padx=(10, 2))
+
+        self.low_var = tk.StringVar(value='0')
+        low_entry = ttk.Entry(frame, width=6, textvariable=self.low_var)
+        low_entry.pack(side=tk.LEFT, padx=(2, 2))
+
+        self.high_var = tk.StringVar(value='127')
+        high_entry = ttk.Entry(frame, width=6, textvariable=self.high_var)
+        high_entry.pack(side=tk.LEFT, padx=(2, 5))
+
+        self.connected_var = tk.BooleanVar(value=False)
+        connected_check = ttk.Checkbutton(frame, text='connected', variable=self.connected_var)
+        connected_check.pack(side=tk.LEFT, padx=(5, 10))
+
+        label = ttk.Label(frame, text='brush')
+        label.pack(side=tk.LEFT, padx=(10, 2))
+
+        # The radius of the brush in pixels of the image.
+        self.brush_var = tk.StringVar(value='10')
+        brush_entry = ttk.Entry(frame, width=6, textvariable=self.brush_var)
+        brush_entry.pack(side=tk.LEFT, padx=(2, 10))
+
+        self.progressbar = ttk.Progressbar(frame, length=100, maximum=1.0)
+        self.progressbar.pack(side=tk.LEFT, padx=(10, 2))
+
+        self.cancel_button = ttk.Button(frame, text='Cancel', command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=(2, 10))
+
     def create_menu(self):
         menubar = tk.Menu(self.master)
         self.master.config(menu=menubar)
@@ -115,100 +184,229 @@ class Window(ttk.Frame):
 
         edit_menu = tk.Menu(menubar, tearoff=False)
         menubar.add_cascade(label='Edit', menu=edit_menu)
-        edit_menu.add_command(label='Undo', command=self.change_cursor, accelerator="Ctrl+Z")
-
-        self.bind_all("<Control-z>", self.change_cursor)
+        edit_menu.add_command(label='Undo', command=self.undo, accelerator="Ctrl+Z")
+        edit_menu.add_command(label='Redo', command=self.redo, accelerator="Ctrl+Y")
+        edit_menu.add_command(label='Erase', command=self.change_cursor, accelerator="Ctrl+E")
+        edit_menu.add_checkbutton(
+            label='Auto select', variable=self.auto_select_var, accelerator="Ctrl+R")
+        edit_menu.add_separator()
+
+        for tool, accelerator in [('rectangle', 'Ctrl+1'), ('brush', 'Ctrl+2'), ('lasso', 'Ctrl+3')]:
+            edit_menu.add_radiobutton(
+                label=tool.capitalize(), value=tool, variable=self.tool_var, accelerator=accelerator)
+            self.bind_all(f'<Control-Key-{accelerator[-1]}>', lambda event, tool=tool: self.tool_var.set(tool))
+
+        options_menu = tk.Menu(menubar, tearoff=False)
+        menubar.add_cascade(label='Options', menu=options_menu)
+
+        # An empty value means the default of OpenCV.
+        self.compression_var = tk.StringVar(value='')
+        compression_menu = tk.Menu(options_menu, tearoff=False)
+        options_menu.add_cascade(label='PNG compression', menu=compression_menu)
+        compression_menu.add_radiobutton(label='OpenCV default', value='', variable=self.compression_var)
+
+        for level in range(10):
+            compression_menu.add_radiobutton(label=level, value=str(level), variable=self.compression_var)
+
+        self.strategy_var = tk.StringVar(value='')
+        strategy_menu = tk.Menu(options_menu, tearoff=False)
+        options_menu.add_cascade(label='PNG strategy', menu=strategy_menu)
+        strategy_menu.add_radiobutton(label='OpenCV default', value='', variable=self.strategy_var)
+
+        for strategy in STRATEGIES:
+            strategy_menu.add_radiobutton(label=strategy, value=strategy, variable=self.strategy_var)
+
+        self.bind_all("<Control-z>", self.undo)
+        self.bind_all("<Control-y>", self.redo)
+        self.bind_all("<Control-e>", self.change_cursor)
+        self.bind_all("<Control-r>", self.toggle_auto_select)
         self.bind_all("<Control-o>", self.open)
         self.bind_all("<Control-s>", self.save)
 
+    def get_canvas_pt(self, event):
+        x = int(self.canvas.canvasx(event.x))
+        y = int(self.canvas.canvasy(event.y))
+        return Point(x, y)
+
     def mouse_click(self, event):
-        if self.img_tk:
+        if self.img_tk and not self.job:
             scale = float(self.var_scale.get())
             r, c = self.size.scale(1 + scale / 100)
             self.scaled_size = self.size._replace(rows=r, cols=c)
 
-            if self.scaled_size.is_inside(event):
-                self.start_pt = Point(event.x, event.y)
-
-                self.canvas.create_rectangle(
-                    self.start_pt.x,
-                    self.start_pt.y,
-                    self.start_pt.x + 1,
-                    self.start_pt.y + 1,
-                    outline='#00FF00',
-                    width=2,
-                    tag=self.rect_tag
-                )
+            if self.scaled_size.is_inside(pt := self.get_canvas_pt(event)):
+                # The tool is kept until the button is released.
+                self.tool = self.tool_var.get()
+
+                match self.tool:
+                    case 'brush':
+                        if (radius := self.validate_brush()) is None:
+                            return
+                        self.brush_radius = radius
+                        self.stroke_recorded = False
+                        self.paint(pt, pt)
+                    case 'lasso':
+                        self.lasso_pts = [pt]
+                    case _:
+                        self.canvas.create_rectangle(
+                            pt.x,
+                            pt.y,
+                            pt.x + 1,
+                            pt.y + 1,
+                            outline='#00FF00',
+                            width=2,
+                            tag=self.rect_tag
+                        )
+
+                self.start_pt = self.last_pt = pt
 
     def mouse_drag(self, event):
         if self.start_pt:
-            x, y = self.scaled_size.keep_range(event)
-            self.canvas.coords(self.rect_tag, self.start_pt.x, self.start_pt.y, x, y)
+            pt = Point(*self.scaled_size.keep_range(self.get_canvas_pt(event)))
+
+            match self.tool:
+                case 'brush':
+                    self.paint(self.last_pt, pt)
+                case 'lasso':
+                    self.canvas.create_line(
+                        *self.last_pt, *pt, fill='#00FF00', width=2, tag=self.rect_tag)
+                    self.lasso_pts.append(pt)
+                case _:
+                    self.canvas.coords(self.rect_tag, self.start_pt.x, self.start_pt.y, *pt)
+
+            self.last_pt = pt
 
     def mouse_release(self, event):
-        if self.start_pt:
-            self.canvas.delete(self.rect_tag)
-            scale = self.scaled_size.rows / self.size.rows
-            pt0 = self.start_pt.get_original_pt(scale)
+        if not self.start_pt:
+            return
+
+        match self.tool:
+            case 'brush':
+                if self.is_edit:
+                    self.end_erase()
+            case 'lasso':
+                self.canvas.delete(self.rect_tag)
+                self.fill_lasso()
+            case _:
+                self.select_rect(event)
 
-            x, y = self.scaled_size.keep_range(event)
-            end_pt = Point(x, y)
-            pt1 = end_pt.get_original_pt(scale)
+        self.start_pt = None
 
-            x0, x1 = min(pt0.x, pt1.x), max(pt0.x, pt1.x)
-            y0, y1 = min(pt0.y, pt1.y), max(pt0.y, pt1.y)
+    def get_scale(self):
+        """Return the scale of the displayed image to the original one.
+        """
+        return self.scaled_size.rows / self.size.rows
 
-            if self.is_edit:
-                self.undo(x0, y0, x1, y1)
-            else:
-                self.draw(x0, y0, x1, y1)
+    def select_rect(self, event):
+        self.canvas.delete(self.rect_tag)
+        scale = self.get_scale()
+        pt0 = self.start_pt.get_original_pt(scale)
 
-            self.start_pt = None
+        x, y = self.scaled_size.keep_range(self.get_canvas_pt(event))
+        end_pt = Point(x, y)
+        pt1 = end_pt.get_original_pt(scale)
+
+        x0, x1 = min(pt0.x, pt1.x), max(pt0.x, pt1.x)
+        y0, y1 = min(pt0.y, pt1.y), max(pt0.y, pt1.y)
+
+        if self.auto_select_var.get():
+            self.auto_select(x0, y0, x1, y1, pt0)
+        elif self.is_edit:
+            self.erase(x0, y0, x1, y1)
+        else:
+            self.draw(x0, y0, x1, y1)
 
     def open(self, event=None):
-        file_type = [('image', '*.png;*.jpg')]
+        if self.job:
+            return
+
+        file_type = [('image', '*.png;*.jpg;*.npy')]
         init_dir = pathlib.Path(__file__).parent
 
         if file_path := filedialog.askopenfilename(filetypes=file_type, initialdir=init_dir):
-            self.show_image(file_path)
+            self.run_job(self.read, self.show_image, file_path)
 
     def save(self, event=None):
-        if self.img_tk:
-            file_type = [('image', '*.png')]
+        if self.img_tk and not self.job:
+            file_type = [('png', '*.png'), ('uncompressed tiff', '*.tif'), ('numpy', '*.npy')]
             init_dir = pathlib.Path(__file__).parent
 
-            if file_path := filedialog.asksaveasfilename(filetypes=file_type, initialdir=init_dir):
+            if file_path := filedialog.asksaveasfilename(
+                    filetypes=file_type, initialdir=init_dir, defaultextension='.png'):
                 self.save_image(file_path)
 
-    def read(self, file_path):
-        mode = cv2.IMREAD_UNCHANGED
+    def run_job(self, func, on_done, *args):
+        """Run func(job, *args) on the worker thread, and pass the future to
+           on_done on the mainloop when it finishes. The canvas input, open and
+           save are ignored until then.
+        """
+        # The rectangle being dragged is dropped.
+        self.canvas.delete(self.rect_tag)
+        self.start_pt = None
 
+        self.job = JobState()
+        future = self.executor.submit(func, self.job, *args)
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.canvas.configure(cursor='watch')
+        self.after(POLL_INTERVAL, self.poll_job, future, on_done)
+
+    def poll_job(self, future, on_done):
+        if not future.done():
+            if (progress := self.job.progress) is None:
+                self.progressbar.configure(mode='indeterminate')
+                self.progressbar.step(0.05)
+            else:
+                self.progressbar.configure(mode='determinate', value=progress)
+
+            self.after(POLL_INTERVAL, self.poll_job, future, on_done)
+            return
+
+        self.job = None
+        self.progressbar.configure(mode='determinate', value=0)
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.canvas.configure(cursor='plus' if self.is_edit else 'arrow')
+        on_done(future)
+
+    def cancel_job(self):
+        """The job stops at the next step; the running step cannot be interrupted.
+        """
+        if self.job:
+            self.job.cancel()
+
+    def read(self, job, file_path):
+        """Called on the worker thread.
+        """
+        img, mode = read_image(file_path)
+        job.report()
+        return img, mode
+
+    def show_image(self, future):
         try:
-            if (img := cv2.imread(file_path, mode)) is None:
-                raise ImageFileError()
-
-        except ImageFileError:
+            img, mode = future.result()
+        except Cancelled:
+            return
+        except (ImageFileError, OSError):
             messagebox.showwarning(
                 "Alert", "Can't open/read file: check file path/integrity.")
-            return None, None
-        else:
-            if len(size := img.shape) == 3 and size[2] == 4:
-                return img, mode
+            return
 
-            return cv2.imread(file_path), cv2.IMREAD_COLOR
+        self.img_org = img
+        self.var_scale.set(0)
+        self.size = Size(*self.img_org.shape, mode=mode)
 
-    def show_image(self, file_path):
-        self.img_org, mode = self.read(file_path)
+        # No full-size RGB copy is made; the regions which are displayed
+        # are converted from self.img_org when needed.
+        self.mask = np.zeros(self.size[:2], dtype=bool)
+        self.history.clear()
+        self.save_buffer = None
+        self.set_viewport_source()
 
-        if self.img_org is not None:
-            self.var_scale.set(0)
-            self.size = Size(*self.img_org.shape, mode=mode)
+        if not self.img_tk:
+            self.canvas_id = self.canvas.create_image(0, 0, anchor=tk.NW)
 
-            code = cv2.COLOR_BGRA2RGBA if self.size.color == 4 else cv2.COLOR_BGR2RGB
-            self.img_cvt = cv2.cvtColor(self.img_org, code)
-            self.img_pil = Image.fromarray(self.img_cvt)
-            self.img_tk = ImageTk.PhotoImage(self.img_pil)
-            self.canvas_id = self.canvas.create_image(0, 0, image=self.img_tk, anchor=tk.NW)
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.render(0)
 
     def validate_alpha(self):
         try:
@@ -219,56 +417,213 @@ class Window(ttk.Frame):
                 "Alert", "Enter a positive integer to alpha field.")
             return None
 
-    def save_image(self, file_path):
-        if (alpha := self.validate_alpha()) is not None:
-            if self.size.color == 3:
-                self.img_org = np.insert(self.img_org, 3, 255, axis=2)
-                self.size = self.size._replace(color=4)
+    def validate_brush(self):
+        try:
+            radius = int(self.brush_var.get())
+        except ValueError:
+            radius = 0
 
-            for i in range(self.size.rows):
-                for j in range(self.size.cols):
-                    arr = self.img_cvt[i, j]
-                    if arr[0] == 0 and arr[1] == 255 and arr[2] == 0:
-                        self.img_org[i, j][3] = alpha
+        if radius < 1:
+            messagebox.showwarning(
+                "Alert", "Enter a positive integer to brush field.")
+            return None
+
+        return radius
+
+    def validate_range(self):
+        try:
+            low, high = int(self.low_var.get()), int(self.high_var.get())
+        except ValueError:
+            low = high = None
+
+        if low is None or not 0 <= low <= high:
+            messagebox.showwarning(
+                "Alert", "Enter positive integers, low <= high, to range fields.")
+            return None
 
-            cv2.imwrite(file_path, self.img_org)
+        return low, high
+
+    def get_save_options(self):
+        compression = int(level) if (level := self.compression_var.get()) else None
+        strategy = self.strategy_var.get() or None
+        return SaveOptions(compression, strategy)
+
+    def save_image(self, file_path):
+        if (alpha := self.validate_alpha()) is not None:
+            options = self.get_save_options()
+            self.run_job(self.write, self.end_save, file_path, alpha, options)
+
+    def write(self, job, file_path, alpha, options):
+        """Called on the worker thread. The mask is not changed meanwhile,
+           because the canvas input is ignored.
+        """
+        # Memory-mapped images can be larger than RAM, so they are saved in row bands.
+        # The file stopped halfway is removed by save_streaming.
+        if isinstance(self.img_org, np.memmap):
+            job.report(0)
+            save_streaming(file_path, self.img_org, self.mask, alpha, options, progress=job.report)
+            return
+
+        # self.img_org is kept untouched so that the later saves and undos
+        # start from the original image. The output buffer is reused.
+        self.save_buffer = to_bgra(self.img_org, self.save_buffer)
+        job.report()
+        apply_alpha(self.save_buffer, self.mask, alpha)
+        job.report()
+        write_image(file_path, self.save_buffer, options)
+
+    def end_save(self, future):
+        try:
+            future.result()
+        except Cancelled:
+            pass
+        except (ImageFileError, OSError) as e:
+            messagebox.showwarning("Alert", str(e))
+
+    def render(self, scale):
+        """Render only the region of the scaled image visible on the canvas.
+        """
+        rows, cols = self.size.scale(1 + scale / 100)
+        self.canvas.configure(scrollregion=(0, 0, cols, rows))
+
+        x = int(self.canvas.canvasx(0))
+        y = int(self.canvas.canvasy(0))
+        w = self.canvas.winfo_width()
+        h = self.canvas.winfo_height()
+
+        img_view = self.viewport.render(rows, cols, x, y, w, h)
+        self.canvas.coords(self.canvas_id, x, y)
+
+        if isinstance(self.img_tk, ImageTk.PhotoImage) and \
+                (self.img_tk.width(), self.img_tk.height()) == img_view.size:
+            self.img_tk.paste(img_view)
+        else:
+            self.img_tk = ImageTk.PhotoImage(img_view)
+            self.canvas.itemconfig(self.canvas_id, image=self.img_tk)
 
     def resize_img(self, str_scale):
         if self.img_tk:
-            scale = float(str_scale)
-            rows, cols = self.size.scale(1 + scale / 100)
+            self.render(float(str_scale))
+
+    def scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self.resize_img(self.var_scale.get())
 
-            img_resize = self.img_pil.resize((cols, rows))
-            img_tk = ImageTk.PhotoImage(img_resize)
-            self.canvas.itemconfig(self.canvas_id, image=img_tk)
-            self.img_tk = img_tk
+    def scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self.resize_img(self.var_scale.get())
 
     def change_cursor(self, event=None):
-        if self.img_tk:
+        if self.img_tk and not self.job:
             self.canvas.configure(cursor='plus')
             self.is_edit = True
 
-    def draw(self, x0, y0, x1, y1):
-        color = [0, 255, 0, 255] if self.size.mode == cv2.IMREAD_UNCHANGED else [0, 255, 0]
-        self.img_cvt[y0: y1 + 1, x0: x1 + 1] = color
-        self.img_pil = Image.fromarray(self.img_cvt)
+    def get_region(self, x0, y0, x1, y1):
+        region = np.s_[y0: y1, x0: x1]
+        return Image.fromarray(overlay(self.img_org[region], self.mask[region]))
+
+    def set_viewport_source(self):
+        mode = 'RGBA' if self.size.color == 4 else 'RGB'
+        self.viewport.set_source(self.get_region, self.size.cols, self.size.rows, mode)
+
+    def refresh(self, x0, y0, x1, y1):
+        """Convert only the changed region and patch the displayed image.
+        """
+        self.viewport.update(x0, y0, x1 + 1, y1 + 1)
         self.resize_img(self.var_scale.get())
 
-    def undo(self, x0, y0, x1, y1):
-        if self.size.color == 4:
-            self.img_org[y0: y1 + 1, x0: x1 + 1, 3] = 255
+    def draw(self, x0, y0, x1, y1):
+        self.history.record(self.mask, x0, y0, x1, y1)
+        self.mask[y0: y1 + 1, x0: x1 + 1] = True
+        self.refresh(x0, y0, x1, y1)
 
-        if self.size.mode == cv2.IMREAD_UNCHANGED:
-            self.img_cvt[y0: y1 + 1, x0: x1 + 1] = self.img_org[y0: y1 + 1, x0: x1 + 1]
-        else:
-            # When once save file, the shape of self.img_org becomes (n, n, n, 4).
-            self.img_cvt[y0: y1 + 1, x0: x1 + 1] = self.img_org[y0: y1 + 1, x0: x1 + 1, :3]
+    def erase(self, x0, y0, x1, y1):
+        self.history.record(self.mask, x0, y0, x1, y1)
+        self.mask[y0: y1 + 1, x0: x1 + 1] = False
+        self.refresh(x0, y0, x1, y1)
+        self.end_erase()
 
-        self.img_pil = Image.fromarray(self.img_cvt)
-        self.resize_img(self.var_scale.get())
+    def end_erase(self):
         self.canvas.configure(cursor='arrow')
         self.is_edit = False
 
+    def paint(self, pt0, pt1):
+        """Rasterize the segment of the brush stroke from pt0 to pt1 on the
+           canvas into the mask, updating only its bounding rectangle. The
+           segments of a stroke are undone at once. In erase mode, they are
+           deselected.
+        """
+        scale = self.get_scale()
+        p0, p1 = pt0.get_original_pt(scale), pt1.get_original_pt(scale)
+
+        if rect := segment_rect(self.mask.shape, p0, p1, self.brush_radius):
+            self.history.record(self.mask, *rect, merge=self.stroke_recorded)
+            self.stroke_recorded = True
+            paint_segment(self.mask, p0, p1, self.brush_radius, not self.is_edit)
+            self.refresh(*rect)
+
+    def fill_lasso(self):
+        """Rasterize the polygon drawn on the canvas into the mask, updating
+           only its bounding rectangle. In erase mode, it is deselected.
+        """
+        scale = self.get_scale()
+        points = [pt.get_original_pt(scale) for pt in self.lasso_pts]
+        self.lasso_pts = []
+
+        if len(points) >= 3 and (rect := polygon_rect(self.mask.shape, points)):
+            self.history.record(self.mask, *rect)
+            fill_polygon(self.mask, points, not self.is_edit)
+            self.refresh(*rect)
+
+        if self.is_edit:
+            self.end_erase()
+
+    def toggle_auto_select(self, event=None):
+        self.auto_select_var.set(not self.auto_select_var.get())
+
+    def auto_select(self, x0, y0, x1, y1, pt):
+        """Select the pixels in the height range within the dragged rectangle,
+           or the whole image if only clicked. If connected is checked, only
+           the pixels connected to the clicked point are selected. In erase
+           mode, they are deselected. Only their bounding rectangle is
+           recorded and refreshed.
+        """
+        if (value_range := self.validate_range()) is None:
+            return
+
+        if (x0, y0) == (x1, y1):
+            x0, y0, x1, y1 = 0, 0, self.size.cols - 1, self.size.rows - 1
+        else:
+            x1, y1 = min(x1, self.size.cols - 1), min(y1, self.size.rows - 1)
+
+        seed = (pt.x, pt.y) if self.connected_var.get() else None
+
+        if result := select_range(self.img_org, *value_range, x0, y0, x1, y1, seed):
+            selected, rect = result
+            x0, y0, x1, y1 = rect
+            self.history.record(self.mask, *rect)
+            region = self.mask[y0: y1 + 1, x0: x1 + 1]
+
+            if self.is_edit:
+                region &= ~selected
+            else:
+                region |= selected
+
+            self.refresh(*rect)
+
+        if self.is_edit:
+            self.end_erase()
+
+    def undo(self, event=None):
+        if self.img_tk and not self.job:
+            if rect := self.history.undo(self.mask):
+                self.refresh(*rect)
+
+    def redo(self, event=None):
+        if self.img_tk and not self.job:
+            if rect := self.history.redo(self.mask):
+                self.refresh(*rect)
+
 
 if __name__ == '__main__':
     root = tk.Tk()
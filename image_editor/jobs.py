@@ -0,0 +1,28 @@
+import threading
+
+
+class Cancelled(Exception):
+    pass
+
+
+class JobState:
+    """Progress and cancellation of the job running on the worker thread.
+       The worker calls report between its steps, and the mainloop reads
+       progress and calls cancel.
+    """
+
+    def __init__(self):
+        # The fraction from 0 to 1 of the done work, or None if unknown.
+        self.progress = None
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def report(self, progress=None):
+        """Raise Cancelled if the job was cancelled; the steps being run
+           cannot be stopped, so it is checked between them.
+        """
+        if self.cancelled.is_set():
+            raise Cancelled
+        self.progress = progress
@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+
+
+# The value of the pixels filled by cv2.floodFill; the selected pixels are 1.
+FILLED = 2
+
+
+def bounding_rect(selected):
+    """Return the rectangle (x0, y0, x1, y1), both edges included, of the
+       selected pixels, or None if no pixel is selected.
+    """
+    if (rows := np.flatnonzero(selected.any(axis=1))).size == 0:
+        return None
+
+    cols = np.flatnonzero(selected.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])
+
+
+def select_range(img, low, high, x0, y0, x1, y1, seed=None):
+    """Select the pixels in the rectangle (x0, y0)-(x1, y1), both edges
+       included, whose first channel is from low to high. The first channel
+       is the height of the heightmaps. If seed (x, y) is given, only the
+       pixels 4-connected to it are selected.
+       Return the bool array of the selected pixels cropped to their bounding
+       rectangle and the rectangle in the image, or None if nothing is selected.
+    Args:
+        img (numpy.ndarray): BGR or BGRA image; 8 or 16 bits.
+        low, high (int): the range of values, both included.
+        seed (tuple): (x, y) in the image.
+    """
+    values = img[y0: y1 + 1, x0: x1 + 1, 0]
+    selected = values >= low
+    selected &= values <= high
+
+    if seed is not None:
+        sx, sy = seed[0] - x0, seed[1] - y0
+
+        if not (0 <= sx <= x1 - x0 and 0 <= sy <= y1 - y0 and selected[sy, sx]):
+            return None
+
+        # The selection is filled in place as uint8; the rectangle of the
+        # filled pixels is returned, so the others need not be scanned.
+        filled = selected.view(np.uint8)
+        _, _, _, (rx, ry, w, h) = cv2.floodFill(filled, None, (int(sx), int(sy)), FILLED, flags=4)
+        selected = filled[ry: ry + h, rx: rx + w] == FILLED
+        return selected, (x0 + rx, y0 + ry, x0 + rx + w - 1, y0 + ry + h - 1)
+
+    if (rect := bounding_rect(selected)) is None:
+        return None
+
+    rx0, ry0, rx1, ry1 = rect
+    return selected[ry0: ry1 + 1, rx0: rx1 + 1], (x0 + rx0, y0 + ry0, x0 + rx1, y0 + ry1)
+
+
+def clip_rect(shape, x0, y0, x1, y1):
+    """Return the rectangle clipped to the mask, or None if outside.
+    """
+    rows, cols = shape
+    x0, y0 = max(int(x0), 0), max(int(y0), 0)
+    x1, y1 = min(int(x1), cols - 1), min(int(y1), rows - 1)
+
+    if x0 > x1 or y0 > y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def segment_rect(shape, p0, p1, radius):
+    """Return the bounding rectangle, both edges included, of the pixels
+       within radius from the segment p0-p1, clipped to the mask, or None.
+    """
+    return clip_rect(
+        shape, min(p0[0], p1[0]) - radius, min(p0[1], p1[1]) - radius,
+        max(p0[0], p1[0]) + radius, max(p0[1], p1[1]) + radius)
+
+
+def paint_segment(mask, p0, p1, radius, value=True):
+    """Set value to the pixels within radius from the segment p0-p1, which is
+       a piece of a brush stroke. Only the bounding rectangle of the segment
+       is computed. Return the rectangle, or None if outside the mask.
+    """
+    if (rect := segment_rect(mask.shape, p0, p1, radius)) is None:
+        return None
+
+    x0, y0, x1, y1 = rect
+    ys, xs = np.ogrid[y0: y1 + 1, x0: x1 + 1]
+    dx, dy = p1[0] - p0[0], p1[1] - p0[1]
+
+    # The nearest point on the segment from each pixel.
+    if length2 := dx * dx + dy * dy:
+        t = np.clip(((xs - p0[0]) * dx + (ys - p0[1]) * dy) / length2, 0, 1)
+    else:
+        t = 0
+
+    dist2 = (xs - (p0[0] + t * dx)) ** 2 + (ys - (p0[1] + t * dy)) ** 2
+    np.copyto(mask[y0: y1 + 1, x0: x1 + 1], value, where=dist2 <= radius ** 2)
+    return rect
+
+
+def polygon_rect(shape, points):
+    """Return the bounding rectangle of the polygon clipped to the mask, or None.
+    """
+    xs, ys = zip(*points)
+    return clip_rect(shape, min(xs), min(ys), max(xs), max(ys))
+
+
+def fill_polygon(mask, points, value=True):
+    """Set value to the pixels inside the polygon, rasterized only in its
+       bounding rectangle. Return the rectangle, or None if outside the mask.
+    Args:
+        points (list): (x, y) of the vertices in the image.
+    """
+    if (rect := polygon_rect(mask.shape, points)) is None:
+        return None
+
+    x0, y0, x1, y1 = rect
+    filled = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    cv2.fillPoly(filled, [np.array(points, dtype=np.int32) - (x0, y0)], 1)
+    np.copyto(mask[y0: y1 + 1, x0: x1 + 1], value, where=filled.view(bool))
+    return rect
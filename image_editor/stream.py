@@ -0,0 +1,155 @@
+import pathlib
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+from transparency import STRATEGIES, ImageFileError, SaveOptions, get_format, to_bgra, apply_alpha
+
+
+# The number of rows processed at once in the streaming save.
+BAND_ROWS = 256
+
+
+class PngWriter:
+    """Write a PNG file row band by row band, so that the whole image is
+       never needed in memory. Each row is written with the Up filter.
+    Args:
+        file_path (str): the output file path.
+        width, height (int): the size of the image.
+        dtype (numpy.dtype): uint8 or uint16.
+        level (int): zlib compression level from 0 to 9; if None, 1.
+        strategy (str): a key of STRATEGIES; if None, RLE without level, and
+                        the zlib default with level.
+        The defaults are those of OpenCV, like SaveOptions.
+    """
+
+    signature = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self, file_path, width, height, dtype=np.uint8, level=None, strategy=None):
+        self.width = width
+        self.height = height
+        self.dtype = np.dtype(dtype)
+        # OpenCV resets the strategy when the level is given.
+        if strategy is not None:
+            strategy = STRATEGIES[strategy][1]
+        else:
+            strategy = zlib.Z_RLE if level is None else zlib.Z_DEFAULT_STRATEGY
+
+        level = 1 if level is None else level
+        self.compressor = zlib.compressobj(level, strategy=strategy)
+        self.prev = None
+        self.written = 0
+
+        self.file = open(file_path, 'wb')
+        self.file.write(self.signature)
+        depth = self.dtype.itemsize * 8
+        # color type 6: RGBA
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, depth, 6, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write_rows(self, band):
+        """Args:
+            band (numpy.ndarray): BGRA rows of the image.
+        """
+        rgba = cv2.cvtColor(band, cv2.COLOR_BGRA2RGBA)
+        rows = rgba.astype(self.dtype.newbyteorder('>'), copy=False).view(np.uint8)
+        rows = rows.reshape(len(band), -1)
+
+        # Up filter: the difference from the row above, wrapping around 256.
+        prev = np.zeros_like(rows[:1]) if self.prev is None else self.prev
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        np.subtract(rows[:1], prev, out=filtered[:1, 1:])
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        self.prev = rows[-1:].copy()
+
+        if data := self.compressor.compress(filtered.tobytes()):
+            self.write_chunk(b'IDAT', data)
+
+        self.written += len(band)
+
+    def close(self):
+        if self.written != self.height:
+            self.file.close()
+            raise ValueError(f'{self.written} rows were written, but the height is {self.height}.')
+
+        self.write_chunk(b'IDAT', self.compressor.flush())
+        self.write_chunk(b'IEND', b'')
+        self.file.close()
+
+
+class NpyWriter:
+    """Write a BGRA .npy file row band by row band through a memory map.
+    """
+
+    def __init__(self, file_path, width, height, dtype=np.uint8):
+        self.out = np.lib.format.open_memmap(
+            file_path, mode='w+', dtype=dtype, shape=(height, width, 4))
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.out.flush()
+        del self.out
+
+    def write_rows(self, band):
+        self.out[self.written: self.written + len(band)] = band
+        self.written += len(band)
+
+
+def save_streaming(file_path, img_org, mask, alpha, options=SaveOptions(), band_rows=BAND_ROWS,
+                   progress=None):
+    """Save img_org as a PNG or .npy file with alpha applied to the selected
+       pixels, processing the rows in bands. Peak memory is bounded by the band
+       size when img_org and mask are memory-mapped.
+    Args:
+        img_org (numpy.ndarray): BGR or BGRA image, like numpy.memmap.
+        mask (numpy.ndarray): bool array having the same rows and cols as img_org.
+        alpha (int): from 0 to 255.
+        options (SaveOptions): compression settings for PNG.
+        progress (callable): called with the fraction of the written rows after
+                             each band; raising an exception stops the save.
+    The file stopped halfway by any exception is removed.
+    """
+    rows, cols = img_org.shape[:2]
+    buffer = None
+
+    match get_format(file_path):
+        case 'png':
+            writer = PngWriter(file_path, cols, rows, img_org.dtype, options.compression, options.strategy)
+        case 'npy':
+            writer = NpyWriter(file_path, cols, rows, img_org.dtype)
+        case fmt:
+            raise ImageFileError(f'{fmt} cannot be saved in row bands: {file_path}')
+
+    try:
+        with writer:
+            for y in range(0, rows, band_rows):
+                band = np.s_[y: y + band_rows]
+                buffer = to_bgra(img_org[band], buffer)
+                apply_alpha(buffer, mask[band], alpha)
+                writer.write_rows(buffer)
+
+                if progress:
+                    progress(writer.written / rows)
+    except BaseException:
+        pathlib.Path(file_path).unlink(missing_ok=True)
+        raise
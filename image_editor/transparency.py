@@ -0,0 +1,202 @@
+import pathlib
+import tempfile
+import zlib
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+
+MARKER_COLOR = (0, 255, 0)
+
+# Images larger than this (bytes) are kept in a memory-mapped temporary file.
+MEMMAP_THRESHOLD = 256 * 1024 ** 2
+
+# Formats which cannot have alpha channel; IMREAD_COLOR also applies EXIF orientation.
+NO_ALPHA_SUFFIXES = {'.jpg', '.jpeg'}
+
+
+# PNG compression strategies: (OpenCV flag, zlib flag)
+STRATEGIES = {
+    'default': (cv2.IMWRITE_PNG_STRATEGY_DEFAULT, zlib.Z_DEFAULT_STRATEGY),
+    'filtered': (cv2.IMWRITE_PNG_STRATEGY_FILTERED, zlib.Z_FILTERED),
+    'huffman_only': (cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY, zlib.Z_HUFFMAN_ONLY),
+    'rle': (cv2.IMWRITE_PNG_STRATEGY_RLE, zlib.Z_RLE),
+    'fixed': (cv2.IMWRITE_PNG_STRATEGY_FIXED, zlib.Z_FIXED),
+}
+
+# Output formats by suffix; TIFF and NPY are written uncompressed.
+FORMATS = {'.png': 'png', '.tif': 'tiff', '.tiff': 'tiff', '.npy': 'npy'}
+
+# libtiff COMPRESSION_NONE
+TIFF_COMPRESSION_NONE = 1
+
+
+class ImageFileError(Exception):
+    pass
+
+
+class SaveOptions(NamedTuple):
+    """Args:
+        compression (int): PNG compression level from 0 to 9.
+        strategy (str): a key of STRATEGIES.
+        If None, the default of OpenCV (level 1 with RLE) is used.
+    """
+
+    compression: int = None
+    strategy: str = None
+
+    def png_params(self):
+        params = []
+
+        # Setting compression resets strategy, so it comes first.
+        if self.compression is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, self.compression]
+
+        if self.strategy is not None:
+            params += [cv2.IMWRITE_PNG_STRATEGY, STRATEGIES[self.strategy][0]]
+
+        return params
+
+
+def get_format(file_path):
+    if (fmt := FORMATS.get(pathlib.Path(file_path).suffix.lower())) is None:
+        raise ImageFileError(f'Unsupported output format: {file_path}')
+    return fmt
+
+
+def write_image(file_path, img, options=SaveOptions()):
+    """Write the image in the format given by the suffix of file_path.
+       Raise ImageFileError if the file cannot be written.
+    """
+    match get_format(file_path):
+        case 'npy':
+            np.save(file_path, img)
+            return
+        case 'tiff':
+            params = [cv2.IMWRITE_TIFF_COMPRESSION, TIFF_COMPRESSION_NONE]
+        case _:
+            params = options.png_params()
+
+    if not cv2.imwrite(str(file_path), img, params):
+        raise ImageFileError(f"Can't write file: {file_path}")
+
+
+def to_memmap(img):
+    """Copy the image into a memory-mapped temporary file, which is deleted
+       when the returned array is released.
+    """
+    buffer = np.memmap(tempfile.TemporaryFile(), dtype=img.dtype, mode='w+', shape=img.shape)
+    buffer[:] = img
+    return buffer
+
+
+def to_bgr(img):
+    """Convert the image read with IMREAD_UNCHANGED to 8-bit BGR in the same
+       way as IMREAD_COLOR does, without decoding the file again.
+    """
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    return img
+
+
+def read_npy(file_path):
+    """Memory-map the BGR or BGRA image saved as .npy without loading it.
+    """
+    try:
+        img = np.load(file_path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        raise ImageFileError(f"Can't open/read file: {file_path}") from e
+
+    if img.ndim != 3 or img.shape[2] not in (3, 4) or img.dtype not in (np.uint8, np.uint16):
+        raise ImageFileError(f'Not BGR or BGRA image: {file_path}')
+
+    return img, cv2.IMREAD_UNCHANGED if img.shape[2] == 4 else cv2.IMREAD_COLOR
+
+
+def read_image(file_path, memmap_threshold=MEMMAP_THRESHOLD):
+    """Return the image and the imread mode equivalent to the way it was read:
+       IMREAD_UNCHANGED for BGRA images and IMREAD_COLOR for the others.
+       The file is decoded only once, and .npy files are memory-mapped without
+       loading. Raise ImageFileError if the file cannot be read.
+    Args:
+        memmap_threshold (int): images larger than this (bytes) are memory-mapped;
+                                if None, never memory-mapped.
+    """
+    if (suffix := pathlib.Path(file_path).suffix.lower()) == '.npy':
+        return read_npy(file_path)
+
+    if suffix in NO_ALPHA_SUFFIXES:
+        mode = cv2.IMREAD_COLOR
+    else:
+        mode = cv2.IMREAD_UNCHANGED
+
+    if (img := cv2.imread(str(file_path), mode)) is None:
+        raise ImageFileError(f"Can't open/read file: {file_path}")
+
+    if not (img.ndim == 3 and img.shape[2] == 4):
+        img = to_bgr(img)
+        mode = cv2.IMREAD_COLOR
+
+    if memmap_threshold is not None and img.nbytes > memmap_threshold:
+        img = to_memmap(img)
+
+    return img, mode
+
+
+def to_bgra(img, out=None):
+    """Copy the BGR or BGRA image into the BGRA buffer out. If out is None or
+       does not fit the image, a new buffer is allocated. BGR images get
+       an opaque alpha channel.
+    Args:
+        img (numpy.ndarray): 8-bit BGR image or BGRA image.
+        out (numpy.ndarray): the buffer to be reused.
+    """
+    shape = (*img.shape[:2], 4)
+
+    if out is None or out.shape != shape or out.dtype != img.dtype:
+        out = np.empty(shape, dtype=img.dtype)
+
+    if img.shape[2] == 3:
+        cv2.cvtColor(img, cv2.COLOR_BGR2BGRA, dst=out)
+    else:
+        np.copyto(out, img)
+
+    return out
+
+
+def apply_alpha(img_org, mask, alpha):
+    """Set alpha to the selected pixels of img_org in place.
+       np.copyto is used, because boolean indexing allocates index arrays
+       larger than the image.
+    Args:
+        img_org (numpy.ndarray): BGRA image.
+        mask (numpy.ndarray): bool array having the same rows and cols as img_org.
+        alpha (int): from 0 to 255.
+    """
+    np.copyto(img_org[..., 3], alpha, where=mask)
+
+
+def overlay(img_org, mask):
+    """Return the RGB or RGBA copy of img_org on which the selected pixels
+       are painted with the marker color. Pass a region of the image to avoid
+       converting the whole image.
+    Args:
+        img_org (numpy.ndarray): BGR or BGRA image.
+        mask (numpy.ndarray): bool array having the same rows and cols as img_org.
+    """
+    if img_org.shape[2] == 4:
+        img = img_org[..., [2, 1, 0, 3]]
+    else:
+        img = img_org[..., ::-1].copy()
+
+    img[mask, :3] = MARKER_COLOR
+
+    if img.shape[2] == 4:
+        img[mask, 3] = 255
+
+    return img
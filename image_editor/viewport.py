@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+from PIL import Image
+
+
+class TileCache:
+    """LRU cache of the scaled tiles.
+    Args:
+        capacity (int): the maximum number of tiles.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tiles = OrderedDict()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def get(self, key):
+        if (tile := self.tiles.get(key)) is not None:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+
+        while len(self.tiles) > self.capacity:
+            self.tiles.popitem(last=False)
+
+    def clear(self):
+        self.tiles.clear()
+
+    def discard(self, keys):
+        for key in keys:
+            del self.tiles[key]
+
+
+class Viewport:
+    """Render only the visible region of the scaled image, using the cached
+       tiles which were already scaled. The image is not held as a whole;
+       the regions needed to make tiles are requested to get_region.
+    Args:
+        tile_size (int): the size of tiles in the scaled image.
+        capacity (int): the maximum number of cached tiles.
+    """
+
+    # Resampling refers the pixels around a tile within the filter support.
+    margin = 3
+
+    def __init__(self, tile_size=256, capacity=256):
+        self.tile_size = tile_size
+        self.cache = TileCache(capacity)
+        self.get_region = None
+
+    def set_source(self, get_region, width, height, mode):
+        """Args:
+            get_region (callable): get_region(x0, y0, x1, y1) returns PIL.Image
+                                   of the region [x0, x1) x [y0, y1) of the image.
+            width, height (int): the size of the image.
+            mode (str): the PIL mode of the image returned by get_region.
+        """
+        self.get_region = get_region
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.cache.clear()
+
+    def update(self, x0, y0, x1, y1):
+        """Drop only the cached tiles overlapping the changed region
+           [x0, x1) x [y0, y1) in every zoom level.
+        """
+        dirty = []
+
+        for key in self.cache.tiles:
+            rows, cols, tx, ty = key
+            sx = self.width / cols
+            sy = self.height / rows
+
+            tile_x0 = tx * self.tile_size * sx - self.margin
+            tile_y0 = ty * self.tile_size * sy - self.margin
+            tile_x1 = (tx + 1) * self.tile_size * sx + self.margin
+            tile_y1 = (ty + 1) * self.tile_size * sy + self.margin
+
+            if tile_x0 < x1 and x0 < tile_x1 and tile_y0 < y1 and y0 < tile_y1:
+                dirty.append(key)
+
+        self.cache.discard(dirty)
+
+    def get_tile(self, rows, cols, tx, ty):
+        """Return the tile at (tx, ty) of the image scaled to (rows, cols).
+        """
+        key = (rows, cols, tx, ty)
+
+        if (tile := self.cache.get(key)) is None:
+            x0 = tx * self.tile_size
+            y0 = ty * self.tile_size
+            x1 = min(x0 + self.tile_size, cols)
+            y1 = min(y0 + self.tile_size, rows)
+
+            sx = self.width / cols
+            sy = self.height / rows
+            box = (x0 * sx, y0 * sy, x1 * sx, y1 * sy)
+
+            # Only the source region of the tile is converted.
+            rx0 = max(0, int(box[0]) - self.margin)
+            ry0 = max(0, int(box[1]) - self.margin)
+            rx1 = min(self.width, int(box[2]) + 1 + self.margin)
+            ry1 = min(self.height, int(box[3]) + 1 + self.margin)
+            region = self.get_region(rx0, ry0, rx1, ry1)
+
+            box = (box[0] - rx0, box[1] - ry0, box[2] - rx0, box[3] - ry0)
+            tile = region.resize((x1 - x0, y1 - y0), box=box)
+            self.cache.put(key, tile)
+
+        return tile
+
+    def render(self, rows, cols, x, y, w, h):
+        """Return the region (x, y, w, h) of the image scaled to (rows, cols).
+        """
+        x = max(0, min(x, cols - 1))
+        y = max(0, min(y, rows - 1))
+        w = max(1, min(w, cols - x))
+        h = max(1, min(h, rows - y))
+        img = Image.new(self.mode, (w, h))
+
+        for ty in range(y // self.tile_size, (y + h - 1) // self.tile_size + 1):
+            for tx in range(x // self.tile_size, (x + w - 1) // self.tile_size + 1):
+                tile = self.get_tile(rows, cols, tx, ty)
+                img.paste(tile, (tx * self.tile_size - x, ty * self.tile_size - y))
+
+        return img
@@ -0,0 +1,106 @@
+import hashlib
+import pathlib
+
+from panda3d.core import Filename, NodePath, PNMImage, Texture, SamplerState, get_model_path
+
+
+# The directory of the baked terrain and texture files.
+CACHE_DIR = 'cache'
+
+
+def cache_key(*file_paths, **params):
+    """Return the hash of the files and the parameters which change the
+       baked result, like the heightmap, the hole mask and the hole mode.
+       None in file_paths stands for an omitted file.
+    """
+    h = hashlib.sha1()
+
+    for file_path in file_paths:
+        if file_path:
+            h.update(pathlib.Path(file_path).read_bytes())
+        h.update(b'\0')
+
+    h.update(repr(sorted(params.items())).encode())
+    return h.hexdigest()
+
+
+def write_baked(file_path, terrain_root):
+    """Write the terrain node having the collision shapes and the blocks of
+       GeoMipTerrain, holes included, to bam. Call before setting the shader;
+       ShaderAttrib cannot be read from bam, so it is set after loading.
+    """
+    file_path = pathlib.Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    root = NodePath('baked_terrain')
+    terrain_root.copy_to(root)
+
+    if not root.write_bam_file(Filename.from_os_specific(str(file_path))):
+        raise OSError(f"Can't write file: {file_path}")
+
+
+def read_baked(loader, file_path):
+    """Return the terrain node written by write_baked.
+    """
+    root = loader.load_model(Filename.from_os_specific(str(file_path)), noCache=True)
+    return root.find('terrain_root')
+
+
+def resolve(file_path):
+    """Return the path of the file found on model-path, as the loader finds it.
+    """
+    filename = Filename(file_path)
+
+    if not filename.resolve_filename(get_model_path().get_value()):
+        raise OSError(f"Can't find file: {file_path}")
+
+    return pathlib.Path(filename.to_os_specific())
+
+
+def bake_texture(file_path, cache_file, max_size=None):
+    """Write the texture having all the mipmaps to txo, Panda3D's native
+       format, downscaled so that the longer side is max_size if larger.
+       Return the texture.
+    """
+    img = PNMImage(Filename.from_os_specific(str(file_path)))
+
+    if not img.is_valid():
+        raise OSError(f"Can't open/read file: {file_path}")
+
+    if max_size and (scale := max_size / max(img.get_x_size(), img.get_y_size())) < 1:
+        resized = PNMImage(
+            max(round(img.get_x_size() * scale), 1), max(round(img.get_y_size() * scale), 1),
+            img.get_num_channels(), img.get_maxval(), img.get_type())
+        resized.gaussian_filter_from(1.0, img)
+        img = resized
+
+    tex = Texture(pathlib.Path(file_path).name)
+    tex.load(img)
+    tex.set_minfilter(SamplerState.FT_linear_mipmap_linear)
+    tex.generate_ram_mipmap_images()
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    if not tex.write(Filename.from_os_specific(str(cache_file))):
+        raise OSError(f"Can't write file: {cache_file}")
+
+    return tex
+
+
+def load_texture(loader, file_path, cache_dir=None, max_size=None):
+    """Return the mipmapped texture. If cache_dir is given, the texture is
+       loaded from the txo file baked from the same source and max_size,
+       which is made if missing; the image is not decoded and the mipmaps
+       are not generated. Otherwise the driver generates the mipmaps.
+    """
+    if cache_dir is None:
+        tex = loader.load_texture(file_path)
+        tex.set_minfilter(SamplerState.FT_linear_mipmap_linear)
+        return tex
+
+    source = resolve(file_path)
+    cache_file = pathlib.Path(cache_dir) / f'{cache_key(source, max_size=max_size)}.txo'
+
+    if cache_file.exists():
+        return loader.load_texture(Filename.from_os_specific(str(cache_file)))
+
+    return bake_texture(source, cache_file, max_size)
@@ -0,0 +1,275 @@
+import argparse
+import contextlib
+import io
+import multiprocessing
+import pathlib
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from panda3d.bullet import BulletWorld, BulletRigidBodyNode, BulletHeightfieldShape, ZUp
+from panda3d.core import Filename, PNMImage, Point3, load_prc_file_data
+
+from holes import get_heights, make_collision_shape, cut_from_mask
+from picking import HeightQuadtree
+from paging import to_pnm
+
+
+TERRAIN_DIR = pathlib.Path(__file__).parent / 'terrain'
+
+# Render without a window, and without waiting for the vertical sync.
+HEADLESS_CONFIG = """
+    window-type offscreen
+    load-display p3headlessgl
+    audio-library-name null
+    sync-video false
+    print-pipe-types false
+    notify-level error
+    notify-level-device fatal"""
+
+
+def make_rays(rows, cols, height, n, seed=0):
+    """Return the segments from the camera positions above the south side
+       of the terrain toward random points on it, in the coordinates of
+       BulletHeightfieldShape: the center of the terrain is the origin.
+    """
+    rng = np.random.default_rng(seed)
+    cx, cy = (cols - 1) / 2, (rows - 1) / 2
+    starts = np.stack([
+        rng.uniform(-cx, cx, n),
+        rng.uniform(-3 * cy, -cy, n),
+        rng.uniform(height, 4 * height, n)], axis=1)
+    targets = np.stack([
+        rng.uniform(-cx, cx, n),
+        rng.uniform(-cy, cy, n),
+        np.full(n, -height / 2)], axis=1)
+    return starts, starts + (targets - starts) * 2
+
+
+def pick_bullet(world, starts, ends):
+    hits = []
+
+    for start, end in zip(starts, ends):
+        result = world.ray_test_closest(Point3(*start), Point3(*end))
+        hits.append(result.get_hit_pos().xy if result.has_hit() else None)
+
+    return hits
+
+
+def pick_quadtree(quadtree, starts, ends, rows, cols, height):
+    # To the coordinates of GeoMipTerrain.
+    offset = np.array([(cols - 1) / 2, (rows - 1) / 2, height / 2])
+    scale = np.array([1, 1, height])
+    hits = []
+
+    for start, end in zip((starts + offset) / scale, (ends + offset) / scale):
+        pos = quadtree.pick(start, end - start)
+        hits.append(None if pos is None else pos[:2] - offset[:2])
+
+    return hits
+
+
+def make_world(shape):
+    world = BulletWorld()
+    node = BulletRigidBodyNode('terrain')
+    node.add_shape(shape)
+    world.attach(node)
+    return world
+
+
+def punch_random_holes(shape, n, radius=3, seed=0):
+    rng = np.random.default_rng(seed)
+    rows, cols = shape
+    ys, xs = np.ogrid[:rows, :cols]
+    mask = np.zeros(shape, dtype=bool)
+
+    for x, y in rng.integers(0, (cols, rows), size=(n, 2)):
+        mask |= (xs - x) ** 2 + (ys - y) ** 2 <= radius ** 2
+
+    return mask
+
+
+def run_pick(file_paths, n, height=50, holes=30):
+    print(f'{"heightmap":>12} {"method":>22} {"picks/s":>10} {"agree":>7}')
+
+    for file_path in file_paths:
+        img = PNMImage(Filename(file_path))
+        heights = get_heights(img)
+        rows, cols = heights.shape
+        starts, ends = make_rays(rows, cols, height, n)
+        cut = cut_from_mask(punch_random_holes(heights.shape, holes))
+
+        shape = BulletHeightfieldShape(img, height, ZUp)
+        shape.set_use_diamond_subdivision(True)
+        cases = [
+            ('heightfield', make_world(shape), None),
+            ('triangle mesh', make_world(make_collision_shape(heights, cut, 0, 0, cols, rows, height)), cut),
+        ]
+
+        for name, world, hole_cut in cases:
+            quadtree = HeightQuadtree(heights, hole_cut)
+
+            for method, func, args in (
+                    (f'bullet {name}', pick_bullet, (world, starts, ends)),
+                    (f'quadtree {name}', pick_quadtree, (quadtree, starts, ends, rows, cols, height))):
+                start = time.perf_counter()
+                hits = func(*args)
+                elapsed = time.perf_counter() - start
+
+                if func is pick_bullet:
+                    expected = hits
+
+                # The hits within 1 pixel are regarded as the same.
+                agree = sum((a is None and b is None) or (a is not None and b is not None and
+                            np.abs(np.subtract(a, b)).max() < 1) for a, b in zip(hits, expected))
+                print(f'{file_path.name:>12} {method:>22} {n / elapsed:>10.0f} {agree / n:>7.1%}')
+
+
+def make_heightmap(file_path, size, seed=0):
+    """Write the 16-bit heightmap of size x size pixels made of random waves.
+    """
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[:size, :size] / size
+    heights = np.zeros((size, size))
+
+    for freq in (2, 4, 8, 16):
+        fx, fy, px, py = rng.uniform(0.5, 1.5, 2).tolist() + rng.uniform(0, 2 * np.pi, 2).tolist()
+        heights += np.sin(xs * freq * fx * 2 * np.pi + px) * np.cos(ys * freq * fy * 2 * np.pi + py) / freq
+
+    heights = (heights - heights.min()) / np.ptp(heights)
+    to_pnm((heights * 65535).astype(np.uint16)).write(Filename.from_os_specific(str(file_path)))
+
+
+def run_headless_case(heightmap, holes, hole_mode, seed=0):
+    """Run TestTerrain offscreen, make holes at random positions, one per
+       frame, and return the times in seconds. Called in a new process,
+       because ShowBase can be made only once in a process.
+    """
+    load_prc_file_data('', HEADLESS_CONFIG)
+    from create_terrain import TestTerrain
+
+    # The messages shown in the GUI are also printed.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        app = TestTerrain(hole_mode=hole_mode, heightmap=str(heightmap))
+        generate = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    cols, rows = app.img_size
+    blocks = -(-(cols - 1) // app.terrain.get_block_size())
+    hole_times = []
+    frame_times = []
+
+    # The first frames compile the shader.
+    for _ in range(3):
+        app.taskMgr.step()
+
+    for _ in range(holes):
+        start = time.perf_counter()
+        if hole_mode in ('triangle', 'discard'):
+            app.punch_hole_at(*rng.uniform(0, cols - 1, 2))
+        else:
+            app.hide_triangles(*rng.integers(0, blocks, 2).tolist())
+        hole_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        app.taskMgr.step()
+        frame_times.append(time.perf_counter() - start)
+
+    app.destroy()
+    return dict(size=f'{cols}x{rows}', generate=generate, holes=hole_times, frames=frame_times)
+
+
+def percentile(values, q):
+    return np.percentile(values, q) * 1000
+
+
+def run_headless(heightmaps, sizes, holes, hole_mode):
+    print(f'{"heightmap":>18} {"size":>10} {"generate s":>11} {"hole ms":>8} '
+          f'{"hole p99":>9} {"frame p50":>10} {"frame p99":>10}')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cases = list(heightmaps)
+        for size in sizes:
+            make_heightmap(file_path := pathlib.Path(temp_dir) / f'synthetic_{size}.png', size)
+            cases.append(file_path)
+
+        # A new process for each case.
+        context = multiprocessing.get_context('spawn')
+        for file_path in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_headless_case, file_path.resolve(), holes, hole_mode).result()
+
+            print(f'{file_path.name:>18} {result["size"]:>10} {result["generate"]:>11.3f} '
+                  f'{statistics.mean(result["holes"]) * 1000:>8.2f} {percentile(result["holes"], 99):>9.2f} '
+                  f'{percentile(result["frames"], 50):>10.2f} {percentile(result["frames"], 99):>10.2f}')
+
+
+def run_startup_case(heightmap, cache_dir, texture_size):
+    """Start TestTerrain offscreen and return the times of generate_terrain.
+       Called in a new process, so that no texture is in TexturePool.
+    """
+    load_prc_file_data('', HEADLESS_CONFIG)
+    from create_terrain import TestTerrain
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = TestTerrain(
+            cache_dir=cache_dir, heightmap=str(heightmap), texture_size=texture_size)
+
+    app.destroy()
+    return app.start_times
+
+
+def run_startup(heightmaps, texture_size):
+    print(f'{"heightmap":>18} {"cache":>8} {"terrain s":>10} {"textures s":>11} {"total s":>8}')
+    context = multiprocessing.get_context('spawn')
+
+    for file_path in heightmaps:
+        # The cache is made on the cold start and used on the warm start.
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for case, case_dir in [('none', None), ('cold', cache_dir), ('warm', cache_dir)]:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    times = executor.submit(
+                        run_startup_case, file_path.resolve(), case_dir, texture_size).result()
+
+                print(f'{file_path.name:>18} {case:>8} {times["terrain"]:>10.3f} '
+                      f'{times["textures"]:>11.3f} {times["total"]:>8.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the terrain.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pick_parser = subparsers.add_parser('pick', help='compare picks per second of Bullet and the quadtree')
+    pick_parser.add_argument(
+        '--heightmaps', type=pathlib.Path, nargs='+',
+        default=[TERRAIN_DIR / 'sample_1.png', TERRAIN_DIR / 'sample_2.png'])
+    pick_parser.add_argument('--rays', type=int, default=1000)
+
+    headless_parser = subparsers.add_parser(
+        'headless', help='run TestTerrain offscreen making holes at random positions')
+    headless_parser.add_argument(
+        '--heightmaps', type=pathlib.Path, nargs='+',
+        default=[TERRAIN_DIR / 'sample_1.png', TERRAIN_DIR / 'sample_2.png'])
+    headless_parser.add_argument(
+        '--sizes', type=int, nargs='*', default=[513, 1025],
+        help='sizes of synthetic heightmaps; power of two plus one')
+    headless_parser.add_argument('--holes', type=int, default=100)
+    headless_parser.add_argument('--hole-mode', choices=['block', 'triangle', 'discard'], default='block')
+
+    startup_parser = subparsers.add_parser(
+        'startup', help='compare the start times without cache, and with cold and warm cache')
+    startup_parser.add_argument(
+        '--heightmaps', type=pathlib.Path, nargs='+',
+        default=[TERRAIN_DIR / 'sample_1.png', TERRAIN_DIR / 'sample_2.png'])
+    startup_parser.add_argument('--texture-size', type=int, help='downscale the cached textures')
+    args = parser.parse_args()
+
+    if args.command == 'pick':
+        run_pick(args.heightmaps, args.rays)
+    elif args.command == 'startup':
+        run_startup(args.heightmaps, args.texture_size)
+    else:
+        run_headless(args.heightmaps, args.sizes, args.holes, args.hole_mode)
@@ -1,7 +1,10 @@
 import sys
 import math
+import time
+import atexit
+import pathlib
+import argparse
 
-import numpy as np
 import direct.gui.DirectGuiGlobals as DGG
 from panda3d.bullet import BulletWorld, BulletDebugNode, BulletRigidBodyNode
 from panda3d.bullet import BulletHeightfieldShape, ZUp
@@ -9,12 +12,21 @@ from direct.showbase.ShowBase import ShowBase
 from direct.showbase.ShowBaseGlobal import globalClock
 from direct.gui.DirectGui import DirectFrame, DirectLabel, DirectSlider
 from panda3d.core import load_prc_file_data
-from panda3d.core import Filename, PNMImage
+from panda3d.core import Filename, PNMImage, PNMImageHeader
 from panda3d.core import Shader, TextureStage, TransparencyAttrib
 from panda3d.core import NodePath, TextNode
-from panda3d.core import Point3, Vec3, Vec2, BitMask32, Vec4
+from panda3d.core import Point3, Vec3, Vec2, BitMask32, Vec4, LVecBase2i
 from panda3d.core import OrthographicLens, Camera, MouseWatcher, PGTop
-from panda3d.core import GeoMipTerrain
+from panda3d.core import GeoMipTerrain, TransformState
+
+import numpy as np
+
+from holes import load_hole_mask, get_heights, fit_heightfield, blocks_in_mask, hole_cells, cut_cells
+from holes import make_collision_shape, make_mask_texture, update_mask_texture, HoleRegistry
+from bake import CACHE_DIR, cache_key, write_baked, read_baked, load_texture
+from picking import HeightQuadtree
+from paging import TerrainPager, read_heightmap, make_heightfield_shape
+from profiling import Profiler
 
 
 load_prc_file_data("", """
@@ -26,10 +38,35 @@ load_prc_file_data("", """
     stm-max-chunk-count 2048""")
 
 
+HOLE_MODES = ('block', 'triangle', 'discard')
+
+
 class TestTerrain(ShowBase):
 
-    def __init__(self):
+    def __init__(self, hole_mask_file=None, hole_mode='block', cache_dir=None,
+                 paged_heightmap=None, tile_size=128, tile_radius=2, profile_file=None,
+                 heightmap='terrain/sample_1.png', texture_size=None):
         super().__init__()
+        self.heightmap = heightmap
+        # If profile_file is given, the stages of update are measured and written to it on exit.
+        self.profiler = Profiler(enabled=profile_file is not None)
+        self.profile_stages = ['update', 'terrain', 'physics', 'pick', 'hide_triangles', 'punch_holes', 'discard_holes']
+        self.profile_index = 0
+        self.hole_mask_file = hole_mask_file
+        # If given, the terrain is baked to bam and the textures to txo in the directory,
+        # and loaded from it next time.
+        self.cache_dir = cache_dir
+        # If given, the cached textures are downscaled to this size.
+        self.texture_size = texture_size
+        # If given, the heightmap is split into tiles loaded around the camera.
+        self.paged_heightmap = paged_heightmap
+        self.tile_size = tile_size
+        self.tile_radius = tile_radius
+        # block: collapse the whole block; triangle: drop only the triangles on holes;
+        # discard: discard the fragments on holes in the shader.
+        self.hole_mode = hole_mode
+        self.hole_radius = 2
+        self.collision_chunk = 32
         self.disable_mouse()
 
         self.world = BulletWorld()
@@ -48,21 +85,44 @@ class TestTerrain(ShowBase):
         self.create_display_region()
         self.create_gui_region()
         self.gui = Gui()
+        self.gui.show_info(self.start_info)
 
-        self.accept('escape', sys.exit)
+        self.accept('escape', self.quit)
         self.accept('d', self.toggle_debug)
+        self.accept('h', self.toggle_hole_mode)
         self.accept('mouse1', self.mouse_click)
         self.accept('mouse1-up', self.mouse_release)
         self.taskMgr.add(self.update, 'update')
 
+        if self.profiler.enabled:
+            atexit.register(self.profiler.write_csv, profile_file)
+            self.accept('p', self.next_profile_stage)
+            self.taskMgr.do_method_later(0.5, self.show_profile, 'show_profile')
+
+        if self.pager:
+            for key, direction in [('arrow_up', Vec3(0, 1, 0)), ('arrow_down', Vec3(0, -1, 0)),
+                                   ('arrow_left', Vec3(-1, 0, 0)), ('arrow_right', Vec3(1, 0, 0))]:
+                self.accept(key, self.pan_camera, [direction])
+                self.accept(f'{key}-repeat', self.pan_camera, [direction])
+
+    def quit(self):
+        if self.pager:
+            self.pager.close()
+        sys.exit()
+
+    def pan_camera(self, direction):
+        """Move the camera over the paged terrain by 1/8 of a tile.
+        """
+        self.display_cam.set_pos(self.display_cam.get_pos() + direction * self.tile_size / 8)
+
     def calc_aspect_ratio(self, display_region):
         """Args:
             display_region (Vec4): (left, right, bottom, top)
             The range is from 0 to 1.
             0: the left and bottom; 1: the right and top.
         """
-        props = self.win.get_properties()
-        window_size = props.get_size()
+        # GraphicsBuffer used offscreen has no window properties.
+        window_size = self.win.get_size()
 
         region_w = display_region.y - display_region.x
         region_h = display_region.w - display_region.z
@@ -132,15 +192,22 @@ class TestTerrain(ShowBase):
         region.set_camera(self.display_cam)
         self.camNode.set_active(False)
 
-        self.display_cam.set_pos(Point3(0, self.img_size.y * -1, 200))
+        # The paged terrain is too large to look over; look at the tiles around the center.
+        distance = self.img_size.y if self.pager is None else self.tile_size * self.tile_radius
+        self.display_cam.set_pos(Point3(0, distance * -1, 200))
         self.display_cam.look_at(Point3(0, 0, 0))
         self.display_cam.reparent_to(self.display_root)
+        # The level of detail follows the camera zoomed by the slider.
+        if self.terrain:
+            self.terrain.set_focal_point(self.display_cam)
         self.display_mw = self.create_mouse_watcher('mw3d', region)
 
     def create_mouse_watcher(self, name, display_region):
         mw_node = MouseWatcher(name)
-        input_ctrl = self.mouseWatcher.get_parent()
-        input_ctrl.attach_new_node(mw_node)
+        # Offscreen, there is no mouse; the watcher is left unattached.
+        if self.mouseWatcher:
+            input_ctrl = self.mouseWatcher.get_parent()
+            input_ctrl.attach_new_node(mw_node)
         mw_node.set_display_region(display_region)
         return mw_node
 
@@ -151,6 +218,14 @@ class TestTerrain(ShowBase):
         else:
             self.debug.hide()
 
+    def toggle_hole_mode(self):
+        self.hole_mode = HOLE_MODES[(HOLE_MODES.index(self.hole_mode) + 1) % len(HOLE_MODES)]
+
+        # The discard shader is kept after leaving discard mode, so that the holes remain.
+        if self.hole_mode == 'discard' and self.terrain and self.mask_tex is None:
+            self.set_terrain_shader()
+        self.gui.show_info(f'Hole mode: {self.hole_mode}')
+
     def mouse_click(self):
         self.dragging = True
         self.dragging_start_time = globalClock.get_frame_time()
@@ -164,32 +239,154 @@ class TestTerrain(ShowBase):
         self.before_mouse_pos.y = 0
 
     def generate_terrain(self):
+        heightmap = self.heightmap
+        height = 50
+        block_size = 8
+        min_level = 2
+        start = time.perf_counter()
+        self.terrain = None
+        self.pager = None
+        self.hole_mask = None
+        self.mask_tex = None
+        self.quadtree = None
+        # The drawn triangles in the cells of the min level having holes are
+        # dropped, and the collision shapes follow the drawn triangles.
+        self.hole_cell = 1 << min_level
+
+        if self.paged_heightmap:
+            self.build_paged_terrain(self.paged_heightmap, height, block_size, min_level)
+            kind = 'paged'
+        else:
+            header = PNMImageHeader()
+            header.read_header(Filename(heightmap))
+            self.set_img_size(header.get_size(), height)
+            baked = None
+
+            if self.cache_dir:
+                key = cache_key(
+                    heightmap, self.hole_mask_file, hole_mode=self.hole_mode,
+                    height=height, block_size=block_size, min_level=min_level)
+                baked = pathlib.Path(self.cache_dir) / f'{key}.bam'
+
+            if baked and baked.exists():
+                # The baked terrain is static; GeoMipTerrain is not made.
+                self.terrain_root = read_baked(self.loader, baked)
+                self.terrain_root.reparent_to(self.display_root)
+                self.world.attach(self.terrain_root.node())
+                self.gmp_root = self.terrain_root.find('geomip_terrain')
+                kind = 'warm'
+
+                # In discard mode, the holes are not baked into the blocks.
+                if self.hole_mode == 'discard' and self.hole_mask_file:
+                    self.hole_mask = load_hole_mask(self.hole_mask_file)
+            else:
+                self.build_terrain(heightmap, height, block_size, min_level)
+                kind = 'cold'
+
+                if baked:
+                    write_baked(baked, self.terrain_root)
+
+        terrain_time = time.perf_counter() - start
+        self.set_terrain_shader()
+        tex_files = [('grass.png', 20), ('grass_04.jpg', 10)]
+        tex_start = time.perf_counter()
+
+        for i, (file_name, tex_scale) in enumerate(tex_files):
+            ts = TextureStage(f'ts{i}')
+            ts.set_sort(i)
+            self.gmp_root.set_shader_input(f'tex_ScaleFactor{i}', tex_scale)
+            tex = load_texture(self.loader, f'textures/{file_name}', self.cache_dir, self.texture_size)
+            self.gmp_root.set_texture(ts, tex)
+
+        texture_time = time.perf_counter() - tex_start
+        self.start_times = dict(
+            terrain=terrain_time, textures=texture_time, total=time.perf_counter() - start)
+        # The label has room only for the total, so the breakdown is printed.
+        print(f'{kind} start: terrain {terrain_time:.3f} s, textures {texture_time:.3f} s, '
+              f'total {self.start_times["total"]:.3f} s')
+        self.start_info = f'{kind} {self.start_times["total"]:.2f} s'
+
+    def set_terrain_shader(self):
+        """In discard mode, set the shader discarding the fragments on holes,
+           which samples the hole mask texture; otherwise the vertices are changed.
+        """
+        fragment = 'terrain_no_discard_f.glsl'
+
+        if self.hole_mode == 'discard' and self.hole_mask is not None:
+            if self.mask_tex is None:
+                self.mask_tex = make_mask_texture(hole_cells(self.hole_mask, self.hole_cell))
+            self.gmp_root.set_shader_input('hole_mask', self.mask_tex)
+            fragment = 'terrain_discard_f.glsl'
+
+        shader = Shader.load(Shader.SL_GLSL, 'shaders/terrain_v.glsl', f'shaders/{fragment}')
+        self.gmp_root.set_shader(shader)
+
+    def set_img_size(self, img_size, height):
+        self.img_size = img_size
+        x = (self.img_size.x - 1) / 2
+        y = (self.img_size.y - 1) / 2
+        self.terrain_pos = Point3(-x, -y, -(height / 2))
+
+    def build_paged_terrain(self, heightmap, height, block_size, min_level):
+        """Split the heightmap into tiles, which are loaded around the camera in update.
+        """
+        heights = read_heightmap(heightmap)
+        self.set_img_size(LVecBase2i(heights.shape[1], heights.shape[0]), height)
+
+        self.pager = TerrainPager(
+            heights, self.world, height, self.tile_size, self.tile_radius, block_size, min_level)
+        self.terrain_root = self.pager.root
+        self.terrain_root.reparent_to(self.display_root)
+        # The tiles inherit the shader and textures.
+        self.gmp_root = self.terrain_root
+
+    def build_terrain(self, heightmap, height, block_size, min_level):
+        """Make the collision shape and GeoMipTerrain from the heightmap, and
+           make the holes given by the hole mask file. The heightmap is decoded
+           once and shared by them. The time of each step is printed.
+        """
+        laps = []
+        last = time.perf_counter()
+
+        def lap(name):
+            nonlocal last
+            now = time.perf_counter()
+            laps.append(f'{name} {now - last:.3f} s')
+            last = now
+
         self.terrain_root = NodePath(BulletRigidBodyNode('terrain_root'))
         self.terrain_root.node().set_mass(0)
         self.terrain_root.set_collide_mask(BitMask32.bit(1))
 
         self.terrain_root.reparent_to(self.display_root)
-        heightmap = 'terrain/sample_1.png'
-        height = 50
 
         img = PNMImage(Filename(heightmap))
+        lap('decode')
+
         shape = BulletHeightfieldShape(img, height, ZUp)
         shape.set_use_diamond_subdivision(True)
         self.terrain_root.node().add_shape(shape)
+        self.heightfield_shape = shape
+        self.height = height
+
+        # The heightfield shape cannot have holes, so it is replaced with
+        # triangle mesh shapes of chunks when the first triangle is dropped.
+        self.collision_shapes = None
+        self.heights = get_heights(img)
+        self.hole_mask = np.zeros(self.heights.shape, dtype=bool)
+        self.holes = HoleRegistry(self.hole_mask, self.hole_cell)
 
         self.world.attach(self.terrain_root.node())
+        lap('collision')
 
         self.terrain = GeoMipTerrain('geomip_terrain')
-        self.terrain.set_heightfield(heightmap)
+        # Passing the file path would make GeoMipTerrain decode it again.
+        self.terrain.set_heightfield(fit_heightfield(img))
         self.terrain.set_border_stitching(True)
-        self.terrain.set_block_size(8)
-        self.terrain.set_min_level(2)
+        self.terrain.set_block_size(block_size)
+        self.terrain.set_min_level(min_level)
         self.terrain.set_focal_point(self.camera)
 
-        self.img_size = img.get_size()
-        x = (self.img_size.x - 1) / 2
-        y = (self.img_size.y - 1) / 2
-        self.terrain_pos = Point3(-x, -y, -(height / 2))
         scale = Vec3(1, 1, height)
         self.gmp_root = self.terrain.get_root()
         self.gmp_root.set_scale(scale)
@@ -197,30 +394,23 @@ class TestTerrain(ShowBase):
 
         self.terrain.generate()
         self.gmp_root.reparent_to(self.terrain_root)
+        lap('geomip')
 
-        # for mx, my in [(6, 4), (8, 12), (14, 6)]:
-        #     self.hide_triangles(mx, my)
+        if self.hole_mask_file:
+            hole_mask = load_hole_mask(self.hole_mask_file)
+            if hole_mask.shape != self.hole_mask.shape:
+                raise ValueError(
+                    f'The hole mask size {hole_mask.shape} does not match the heightfield size.')
 
-        shader = Shader.load(Shader.SL_GLSL, 'shaders/terrain_v.glsl', 'shaders/terrain_no_discard_f.glsl')
-        self.gmp_root.set_shader(shader)
-        tex_files = [('grass.png', 20), ('grass_04.jpg', 10)]
-
-        for i, (file_name, tex_scale) in enumerate(tex_files):
-            ts = TextureStage(f'ts{i}')
-            ts.set_sort(i)
-            self.gmp_root.set_shader_input(f'tex_ScaleFactor{i}', tex_scale)
-            tex = self.loader.load_texture(f'textures/{file_name}')
-            self.gmp_root.set_texture(ts, tex)
+            if self.hole_mode == 'triangle':
+                self.punch_holes(hole_mask)
+            elif self.hole_mode == 'discard':
+                self.discard_holes(hole_mask)
+            else:
+                self.hide_holes(hole_mask)
+            lap('holes')
 
-        # *************************************************************************************
-        # When writing terrain to bam, is it necessarry to do flatten_strong for terrain.root?
-        # Without flatten_strong, shaders did not work well when making model from the bam.
-        # And, attempting to write terrain to bam after setting shader caused an error.
-        # I could not find the way of making the part of triangles in a block invisible. 
-        # TODO: try again about above.
-        # self.gmp_root.flatten_strong()
-        # self.gmp_root.writeBamFile('test3.bam')
-        # *************************************************************************************
+        print(f'load {heightmap}: ' + ', '.join(laps))
 
     def rotate_camera(self, mouse_pos, dt):
         angle = 0
@@ -238,15 +428,167 @@ class TestTerrain(ShowBase):
         """Args:
                 mx and my must be integer.
         """
-        block_np = self.terrain.get_block_node_path(mx, my)
-        geom = block_np.node().modify_geom(0)
-        vdata = geom.modify_vertex_data()
-        v_array = vdata.modify_array(0)
-        view = memoryview(v_array).cast('B').cast('f')
-        view[:] = np.zeros(len(view), dtype=np.float32)
-        self.terrain.update()
+        with self.profiler.measure('hide_triangles'):
+            self.hide_blocks([(mx, my)])
 
-    def get_block_pos(self, mouse_pos):
+    def hide_blocks(self, blocks):
+        """Hide all the blocks in one pass, and update the terrain once.
+        Args:
+            blocks (iterable): (mx, my) of the blocks.
+        """
+        for mx, my in blocks:
+            self.holes.hide(self.terrain, int(mx), int(my))
+
+        self.update_terrain()
+
+    def update_terrain(self):
+        """Update the level of detail, and patch the blocks having holes
+           again if they were regenerated. Return the number of the patched blocks.
+        """
+        if self.terrain and self.terrain.update():
+            patched = self.holes.reapply(self.terrain)
+            # The level of detail changes the drawn triangles of the punched blocks.
+            self.update_collision(self.holes.take_dirty())
+            return patched
+        return 0
+
+    def check_hole_mask(self, hole_mask, x0=0, y0=0):
+        rows, cols = hole_mask.shape
+        if x0 < 0 or y0 < 0 or y0 + rows > self.hole_mask.shape[0] or x0 + cols > self.hole_mask.shape[1]:
+            raise ValueError(
+                f'The hole mask size {hole_mask.shape} at ({x0}, {y0}) does not fit in the heightfield size.')
+
+    def hide_holes(self, hole_mask):
+        """Hide the blocks which have holes.
+        Args:
+            hole_mask (numpy.ndarray): bool array made by load_hole_mask.
+        """
+        self.check_hole_mask(hole_mask)
+
+        with self.profiler.measure('hide_triangles'):
+            blocks = blocks_in_mask(hole_mask, self.terrain.get_block_size())
+            self.hide_blocks(blocks)
+
+        return blocks
+
+    def punch_holes(self, hole_mask, x0=0, y0=0):
+        """Drop only the triangles on the holes from the blocks and the collision
+           shapes. The level of detail is updated in the next frame, like
+           the other frames, because GeoMipTerrain.update visits all the blocks.
+        Args:
+            hole_mask (numpy.ndarray): bool array made by load_hole_mask, or
+                                       of the region at (x0, y0) of the heightfield.
+        """
+        self.check_hole_mask(hole_mask, x0, y0)
+        rows, cols = hole_mask.shape
+
+        with self.profiler.measure('punch_holes'):
+            self.hole_mask[y0: y0 + rows, x0: x0 + cols] |= hole_mask
+            blocks = blocks_in_mask(hole_mask, self.terrain.get_block_size(), x0, y0, self.hole_mask.shape)
+
+            # The block size is a multiple of the cell size, so a cell is in one block.
+            for mx, my in blocks:
+                self.holes.punch(self.terrain, int(mx), int(my))
+
+            self.update_collision(self.holes.take_dirty())
+
+    def discard_holes(self, hole_mask, x0=0, y0=0):
+        """Make the shader discard the fragments on the holes, copying only
+           the changed region to the mask texture, and drop the triangles on
+           the holes from the collision shapes. The blocks are not changed.
+        Args:
+            hole_mask (numpy.ndarray): bool array made by load_hole_mask, or
+                                       of the region at (x0, y0) of the heightfield.
+        """
+        self.check_hole_mask(hole_mask, x0, y0)
+        rows, cols = hole_mask.shape
+
+        with self.profiler.measure('discard_holes'):
+            self.hole_mask[y0: y0 + rows, x0: x0 + cols] |= hole_mask
+            ys, xs = np.nonzero(hole_mask)
+            xs += x0
+            ys += y0
+
+            # The texture is made from the whole mask when the shader is set.
+            if xs.size and self.mask_tex is not None:
+                update_mask_texture(
+                    self.mask_tex, self.hole_mask, self.hole_cell,
+                    xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+
+            # The collision shapes follow the cells of the texture.
+            if xs.size:
+                cut_cells(
+                    self.holes.cut, self.hole_mask, self.hole_cell, xs.min(), ys.min(), xs.max(), ys.max())
+                self.update_collision(
+                    blocks_in_mask(hole_mask, self.terrain.get_block_size(), x0, y0, self.hole_mask.shape))
+
+    def update_collision(self, blocks):
+        """Rebuild the collision shapes of the chunks having the blocks whose cut changed.
+        """
+        if not len(blocks):
+            return
+
+        node = self.terrain_root.node()
+        rows, cols = self.hole_mask.shape
+        size = self.collision_chunk
+        block_size = self.terrain.get_block_size()
+
+        if self.collision_shapes is None:
+            node.remove_shape(self.heightfield_shape)
+            self.collision_shapes = {}
+            nx, ny = -(-(cols - 1) // size), -(-(rows - 1) // size)
+            chunks = [(cx, cy) for cx in range(nx) for cy in range(ny)]
+        else:
+            # The chunk size is a multiple of the block size, so a block is in one chunk.
+            chunks = {(mx * block_size // size, my * block_size // size) for mx, my in blocks}
+
+        for cx, cy in chunks:
+            if (old := self.collision_shapes.pop((cx, cy), None)) is not None:
+                node.remove_shape(old)
+
+            x0, y0 = cx * size, cy * size
+            x1, y1 = min(x0 + size, cols - 1), min(y0 + size, rows - 1)
+
+            if self.holes.cut[y0: y1, x0: x1].any():
+                if not (shape := make_collision_shape(
+                        self.heights, self.holes.cut, x0, y0, x1, y1, self.height)):
+                    continue
+                node.add_shape(shape)
+            else:
+                # The chunks without holes are heightfields, which are far
+                # faster to make than triangle meshes.
+                values = np.rint(self.heights[y0: y1 + 1, x0: x1 + 1] * 65535).astype(np.uint16)
+                shape = make_heightfield_shape(values, self.height)
+                pos = Point3((x0 + x1 - (cols - 1)) / 2, (y0 + y1 - (rows - 1)) / 2, 0)
+                node.add_shape(shape, TransformState.make_pos(pos))
+
+            self.collision_shapes[(cx, cy)] = shape
+
+    def punch_hole_at(self, x, y):
+        """Make the hole within hole_radius around (x, y) of the terrain.
+        """
+        rows, cols = self.hole_mask.shape
+        r = self.hole_radius
+
+        # Only the bounding box of the hole is computed, so that the time
+        # does not depend on the size of the heightfield.
+        x0, y0 = max(math.ceil(x - r), 0), max(math.ceil(y - r), 0)
+        x1, y1 = min(math.floor(x + r), cols - 1), min(math.floor(y + r), rows - 1)
+        if x0 > x1 or y0 > y1:
+            return
+
+        ys, xs = np.ogrid[y0: y1 + 1, x0: x1 + 1]
+        hole_mask = (xs - x) ** 2 + (ys - y) ** 2 <= r ** 2
+
+        if self.hole_mode == 'discard':
+            self.discard_holes(hole_mask, x0, y0)
+        else:
+            self.punch_holes(hole_mask, x0, y0)
+
+    def get_hit_pos(self, mouse_pos):
+        """Return the position on the terrain under the mouse, relative to
+           the origin of GeoMipTerrain, or None.
+        """
         near_pos = Point3()
         far_pos = Point3()
 
@@ -259,31 +601,92 @@ class TestTerrain(ShowBase):
                 from_pos, to_pos, mask=BitMask32.bit(1))).has_hit():
             hit_pos = result.get_hit_pos()
             pos = self.terrain_root.get_relative_point(self.display_root, hit_pos)
-            rel_pos = pos - self.terrain_pos
-            block_pos = self.terrain.get_block_from_pos(*rel_pos.xy)
+            return pos - self.terrain_pos
+
+    def get_block_pos(self, mouse_pos):
+        """Return (mx, my) of the block under the mouse, or None. The ray is
+           intersected with the quadtree instead of the Bullet heightfield,
+           which tests all the triangles in the bounding box of the ray.
+        """
+        near_pos = Point3()
+        far_pos = Point3()
+
+        lens = self.display_cam.node().get_lens()
+        lens.extrude(mouse_pos, near_pos, far_pos)
+        # The quadtree is in the coordinates of GeoMipTerrain.
+        from_pos = self.gmp_root.get_relative_point(self.display_cam, near_pos)
+        to_pos = self.gmp_root.get_relative_point(self.display_cam, far_pos)
+
+        # Only the block mode picks with the quadtree, so it is built on the first pick.
+        if self.quadtree is None:
+            self.quadtree = HeightQuadtree(self.heights, self.holes.cut)
+
+        if (pos := self.quadtree.pick(from_pos, to_pos - from_pos)) is not None:
+            block_pos = self.terrain.get_block_from_pos(pos[0], pos[1])
             x, y = int(block_pos.x), int(block_pos.y)
             return x, y
 
     def update(self, task):
         dt = globalClock.get_dt()
 
-        if self.display_mw.has_mouse():
-            mouse_pos = self.display_mw.get_mouse()
+        with self.profiler.measure('update'):
+            if self.display_mw.has_mouse():
+                mouse_pos = self.display_mw.get_mouse()
 
-            if self.dragging:
-                if globalClock.get_frame_time() - self.dragging_start_time >= 0.2:
-                    self.rotate_camera(mouse_pos, dt)
+                if self.dragging:
+                    if globalClock.get_frame_time() - self.dragging_start_time >= 0.2:
+                        self.rotate_camera(mouse_pos, dt)
 
-            if self.clicked:
-                if pos := self.get_block_pos(mouse_pos):
-                    mx, my = pos
-                    self.hide_triangles(mx, my)
-                    self.gui.show_info(f"Hole: GeomNode gmm{mx}x{my}")
+                if self.clicked:
+                    self.edit_terrain(mouse_pos)
                     self.clicked = False
 
-        self.world.do_physics(dt)
+            with self.profiler.measure('terrain'):
+                if self.pager:
+                    loaded, pending = self.pager.update(self.display_cam)
+                    status = f'tiles: {loaded} loaded, {pending} pending'
+
+                    for message in self.pager.take_errors():
+                        self.gui.show_info(message)
+                else:
+                    status = f'patched: {self.update_terrain()}'
+
+            # While profiling, the label shows the percentiles instead.
+            if not self.profiler.enabled:
+                self.gui.show_status(status)
+
+            with self.profiler.measure('physics'):
+                self.world.do_physics(dt)
+
         return task.cont
 
+    def edit_terrain(self, mouse_pos):
+        if self.terrain is None:
+            self.gui.show_info('The baked or paged terrain cannot be edited.')
+        elif self.hole_mode in ('triangle', 'discard'):
+            with self.profiler.measure('pick'):
+                rel_pos = self.get_hit_pos(mouse_pos)
+
+            if rel_pos is not None:
+                self.punch_hole_at(rel_pos.x, rel_pos.y)
+                self.gui.show_info(f"Hole: ({rel_pos.x:.1f}, {rel_pos.y:.1f})")
+        else:
+            with self.profiler.measure('pick'):
+                pos = self.get_block_pos(mouse_pos)
+
+            if pos:
+                mx, my = pos
+                self.hide_triangles(mx, my)
+                self.gui.show_info(f"Hole: GeomNode gmm{mx}x{my}")
+
+    def show_profile(self, task):
+        self.gui.show_status(self.profiler.summary(self.profile_stages[self.profile_index]))
+        return task.again
+
+    def next_profile_stage(self):
+        self.profile_index = (self.profile_index + 1) % len(self.profile_stages)
+        self.gui.show_status(self.profiler.summary(self.profile_stages[self.profile_index]))
+
 
 class Gui(DirectFrame):
 
@@ -322,11 +725,24 @@ class Gui(DirectFrame):
             command=self.zoom
         )
 
+        # The info and the status are put in two lines on the right of
+        # the slider, so that the long percentiles do not run into the info.
         self.label = DirectLabel(
             parent=self,
-            pos=Point3(0.4, 0, 0),
+            pos=Point3(0.4, 0, 0.02),
             frameColor=(1, 1, 1, 0),
-            text_scale=0.06,
+            text_scale=0.04,
+            text_fg=(1, 1, 1, 1),
+            text='',
+            text_align=TextNode.ALeft,
+        )
+
+        self.status = ''
+        self.status_label = DirectLabel(
+            parent=self,
+            pos=Point3(0.4, 0, -0.06),
+            frameColor=(1, 1, 1, 0),
+            text_scale=0.04,
             text_fg=(1, 1, 1, 1),
             text='',
             text_align=TextNode.ALeft,
@@ -342,7 +758,62 @@ class Gui(DirectFrame):
         self.label.setText(text)
         print(text)
 
+    def show_status(self, text):
+        """Show the state of the terrain updated every frame, like the number
+           of the blocks patched again in the frame. Changing the text every
+           frame regenerates the text geometry, so only a new text is set.
+        """
+        if text != self.status:
+            self.status_label.setText(text)
+            self.status = text
+
 
 if __name__ == '__main__':
-    app = TestTerrain()
+    parser = argparse.ArgumentParser(description='Create a hole by making the triangles in the blocks invisible.')
+    parser.add_argument('--heightmap', default='terrain/sample_1.png')
+    parser.add_argument(
+        '--hole-mask', help='image output by image_editor; the blocks having transparent pixels are hidden')
+    parser.add_argument(
+        '--hole-mode', choices=HOLE_MODES, default='block',
+        help='block: collapse the whole block; triangle: drop only the triangles on holes; '
+             'discard: discard the fragments on holes in the shader')
+    parser.add_argument(
+        '--cache-dir', nargs='?', const=CACHE_DIR,
+        help=f'bake the terrain with the holes to bam and the mipmapped textures to txo in the directory '
+             f'({CACHE_DIR} if omitted), and load them from there next time')
+    parser.add_argument(
+        '--texture-size', type=int, metavar='SIZE',
+        help='downscale the cached textures whose longer side is larger than SIZE')
+    parser.add_argument(
+        '--paged', metavar='HEIGHTMAP',
+        help='split the large heightmap (image or .npy) into tiles loaded around the camera; '
+             'move the camera with the arrow keys')
+    parser.add_argument('--tile-size', type=int, default=128, help='power of two')
+    parser.add_argument('--tile-radius', type=int, default=2)
+    parser.add_argument(
+        '--profile', nargs='?', const='profile.csv', metavar='CSV',
+        help='measure the stages of each frame; [p] switches the stage shown, '
+             'and the percentiles are written to CSV (profile.csv if omitted) on exit')
+    args = parser.parse_args()
+
+    if args.paged and (args.hole_mask or args.cache_dir):
+        parser.error('--paged cannot be used with --hole-mask or --cache-dir')
+
+    if args.texture_size and not args.cache_dir:
+        parser.error('--texture-size needs --cache-dir')
+
+    if args.tile_size & (args.tile_size - 1):
+        parser.error('--tile-size must be a power of two')
+
+    app = TestTerrain(
+        hole_mask_file=args.hole_mask,
+        hole_mode=args.hole_mode,
+        cache_dir=args.cache_dir,
+        paged_heightmap=args.paged,
+        tile_size=args.tile_size,
+        tile_radius=args.tile_radius,
+        profile_file=args.profile,
+        heightmap=args.heightmap,
+        texture_size=args.texture_size,
+    )
     app.run()
\ No newline at end of file
@@ -0,0 +1,398 @@
+import numpy as np
+from panda3d.bullet import BulletTriangleMesh, BulletTriangleMeshShape
+from panda3d.core import Filename, PNMImage, Texture, GeomEnums, SamplerState
+from panda3d.core import PTA_LVecBase3f, PTA_int
+
+
+INDEX_TYPES = {
+    GeomEnums.NT_uint8: np.uint8,
+    GeomEnums.NT_uint16: np.uint16,
+    GeomEnums.NT_uint32: np.uint32,
+}
+
+
+def get_ram_array(img, channels):
+    """Return the channels of PNMImage as numpy array indexed by [y, x]
+       of the terrain, starting from the bottom row.
+    """
+    tex = Texture()
+    tex.load(img)
+    dtype = np.uint16 if tex.get_component_width() == 2 else np.uint8
+    arr = np.frombuffer(memoryview(tex.get_ram_image_as(channels)), dtype=dtype)
+    return arr.reshape(tex.get_y_size(), tex.get_x_size())
+
+
+def get_heights(img):
+    """Return the elevations from 0 to 1 of the heightfield PNMImage, indexed
+       by [y, x] of the terrain like GeoMipTerrain.get_elevation.
+    """
+    gray = get_ram_array(img, 'G')
+    return gray.astype(np.float32) / np.iinfo(gray.dtype).max
+
+
+def fit_heightfield(img):
+    """Return the PNMImage resized to the power of two plus one pixels, as
+       GeoMipTerrain.set_heightfield does only when given the file path.
+    """
+    x, y = img.get_x_size(), img.get_y_size()
+    req_x = (1 << (x - 2).bit_length()) + 1 if x > 1 else x
+    req_y = (1 << (y - 2).bit_length()) + 1 if y > 1 else y
+
+    if (req_x, req_y) == (x, y):
+        return img
+
+    resized = PNMImage(req_x, req_y, img.get_num_channels(), img.get_maxval(), img.get_type())
+    resized.quick_filter_from(img)
+    return resized
+
+
+def load_hole_mask(file_path, threshold=255):
+    """Return the bool array which is True at holes, made from the alpha
+       channel of the image output by image_editor. Pixels whose alpha is
+       less than threshold are holes. The array is indexed by [y, x] of
+       the terrain; y increases upward, unlike the rows of the image.
+    """
+    img = PNMImage(Filename(file_path))
+
+    if not img.is_valid():
+        raise ValueError(f"Can't open/read file: {file_path}")
+
+    if not img.has_alpha():
+        raise ValueError(f'The hole mask has no alpha channel: {file_path}')
+
+    # threshold is given in 8 bits.
+    if (alpha := get_ram_array(img, 'A')).dtype == np.uint16:
+        alpha = alpha >> 8
+
+    return alpha < threshold
+
+
+def count_cells(n, cell_size):
+    """Return the number of the cells along a side of n pixels.
+    """
+    return max(-(-(n - 1) // cell_size), 1)
+
+
+def cell_range(shape, cell_size, x0, y0, x1, y1):
+    """Return the cells (cx0, cy0, cx1, cy1), both edges included, having the
+       pixels [x0, x1] x [y0, y1]. A pixel belongs to the cell x // cell_size;
+       the last row and column belong to the last cells, like blocks_in_mask.
+    """
+    nx, ny = count_cells(shape[1], cell_size), count_cells(shape[0], cell_size)
+    return (min(x0 // cell_size, nx - 1), min(y0 // cell_size, ny - 1),
+            min(x1 // cell_size, nx - 1), min(y1 // cell_size, ny - 1))
+
+
+def hole_cells(mask, cell_size, cx0=0, cy0=0, cx1=None, cy1=None):
+    """Return the bool array indexed by [cy - cy0, cx - cx0] which is True for
+       the cells [cx0, cx1] x [cy0, cy1] having hole pixels. The drawn
+       triangles overlapping these cells are dropped, and the fragments in
+       them are discarded by terrain_discard_f.glsl.
+    """
+    rows, cols = mask.shape
+    nx, ny = count_cells(cols, cell_size), count_cells(rows, cell_size)
+    cx1 = nx - 1 if cx1 is None else cx1
+    cy1 = ny - 1 if cy1 is None else cy1
+
+    # The pixels of the cells; the last cells also have the last row and column.
+    px0, py0 = cx0 * cell_size, cy0 * cell_size
+    px1 = cols - 1 if cx1 == nx - 1 else (cx1 + 1) * cell_size - 1
+    py1 = rows - 1 if cy1 == ny - 1 else (cy1 + 1) * cell_size - 1
+
+    cells = np.zeros((cy1 - cy0 + 1, cx1 - cx0 + 1), dtype=bool)
+    ys, xs = np.nonzero(mask[py0: py1 + 1, px0: px1 + 1])
+    cells[np.minimum((ys + py0) // cell_size, ny - 1) - cy0,
+          np.minimum((xs + px0) // cell_size, nx - 1) - cx0] = True
+    return cells
+
+
+def make_mask_texture(cells):
+    """Make the texture sampled by terrain_discard_f.glsl from hole_cells,
+       which is 0 at the hole cells and 255 elsewhere. The ram image starts
+       from the bottom row like the mask.
+    """
+    rows, cols = cells.shape
+    tex = Texture('hole_mask')
+    tex.setup_2d_texture(cols, rows, Texture.T_unsigned_byte, Texture.F_red)
+    tex.set_minfilter(SamplerState.FT_nearest)
+    tex.set_magfilter(SamplerState.FT_nearest)
+    tex.set_wrap_u(SamplerState.WM_clamp)
+    tex.set_wrap_v(SamplerState.WM_clamp)
+    tex.set_ram_image(np.where(cells, 0, 255).astype(np.uint8).tobytes())
+    return tex
+
+
+def update_mask_texture(tex, mask, cell_size, x0, y0, x1, y1):
+    """Copy only the cells having the pixels [x0, x1) x [y0, y1) of the mask
+       to the ram image of the texture made by make_mask_texture.
+    """
+    cx0, cy0, cx1, cy1 = cell_range(mask.shape, cell_size, x0, y0, x1 - 1, y1 - 1)
+    cells = np.frombuffer(memoryview(tex.modify_ram_image()), dtype=np.uint8)
+    cells = cells.reshape(tex.get_y_size(), tex.get_x_size())
+    cells[cy0: cy1 + 1, cx0: cx1 + 1] = np.where(hole_cells(mask, cell_size, cx0, cy0, cx1, cy1), 0, 255)
+
+
+def blocks_in_mask(mask, block_size, x0=0, y0=0, shape=None):
+    """Return the array of (mx, my) of the blocks which have holes.
+       The last row and column of the heightfield belong to the last blocks.
+    Args:
+        mask (numpy.ndarray): hole mask of the region at (x0, y0) of the heightfield.
+        shape (tuple): (rows, cols) of the heightfield; if None, the shape of mask.
+    """
+    ys, xs = np.nonzero(mask)
+    rows, cols = mask.shape if shape is None else shape
+    mx = np.minimum((xs + x0) // block_size, max(-(-(cols - 1) // block_size) - 1, 0))
+    my = np.minimum((ys + y0) // block_size, max(-(-(rows - 1) // block_size) - 1, 0))
+    return np.unique(np.stack([mx, my], axis=1), axis=0)
+
+
+def on_holes(points, mask, cell_size=1):
+    """Return the bool array which is True for the triangles overlapping
+       the cells having hole pixels. Only the cells under the triangles are
+       computed.
+    Args:
+        points (numpy.ndarray): (n, 3, 2) x and y of the triangle vertices in terrain coordinates.
+        mask (numpy.ndarray): hole mask indexed by [y, x].
+        cell_size (int): the size of the cells of the drawn triangles at the min level.
+    """
+    rows, cols = mask.shape
+    n = np.array([count_cells(cols, cell_size), count_cells(rows, cell_size)])
+
+    # The cells overlapped by the bounding box of each triangle.
+    lo = np.clip(np.floor(points.min(axis=1) / cell_size).astype(np.intp), 0, n - 1)
+    hi = np.clip(np.ceil(points.max(axis=1) / cell_size).astype(np.intp) - 1, lo, n - 1)
+
+    (cx0, cy0), (cx1, cy1) = lo.min(axis=0), hi.max(axis=0)
+    cells = hole_cells(mask, cell_size, cx0, cy0, cx1, cy1)
+
+    # The summed-area table counts the hole cells of each box at once.
+    table = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1), dtype=np.intp)
+    table[1:, 1:] = cells.cumsum(axis=0).cumsum(axis=1)
+    x0, y0 = lo[:, 0] - cx0, lo[:, 1] - cy0
+    x1, y1 = hi[:, 0] - cx0 + 1, hi[:, 1] - cy0 + 1
+    return (table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]) > 0
+
+
+def get_triangles(block_np):
+    """Return the GeomTriangles of the block, its index array, and x and y of
+       the vertices of the triangles in terrain coordinates. The vertices not
+       used at the level of detail may be left uninitialized, so only the used
+       ones are read.
+    """
+    geom = block_np.node().modify_geom(0)
+    vdata = geom.get_vertex_data()
+    array_format = vdata.get_format().get_array(0)
+    stride = array_format.get_stride() // 4
+    start = array_format.get_column('vertex').get_start() // 4
+
+    vertices = np.frombuffer(memoryview(vdata.get_array(0)), dtype=np.float32)
+    vertices = vertices.reshape(-1, stride)[:, start: start + 2]
+    offset = np.array(block_np.get_pos().xy, dtype=np.float32)
+
+    prim = geom.modify_primitive(0)
+    dtype = INDEX_TYPES[prim.get_index_type()]
+    indices = np.frombuffer(memoryview(prim.get_vertices()), dtype=dtype).reshape(-1, 3)
+    return prim, indices, vertices[indices] + offset
+
+
+def drop_triangles(block_np, mask, cell_size=1):
+    """Rewrite the GeomTriangles index buffer of the block, dropping only the
+       triangles on holes. Return the number of dropped triangles.
+    """
+    prim, indices, points = get_triangles(block_np)
+
+    if not indices.size or not (dropped := on_holes(points, mask, cell_size)).any():
+        return 0
+
+    kept = indices[~dropped]
+    v_array = prim.modify_vertices()
+    v_array.set_num_rows(kept.size)
+
+    if kept.size:
+        np.frombuffer(memoryview(v_array), dtype=INDEX_TYPES[prim.get_index_type()])[:] = kept.ravel()
+
+    return np.count_nonzero(dropped)
+
+
+def fine_samples(x0, y0, x1, y1):
+    """Return the (h, w, 2, 2, 2) array of x and y of two points inside each of
+       the two triangles of each cell [x0, x1) x [y0, y1) of make_collision_shape.
+       The points are on both sides of the anti-diagonal of the cell, and
+       never on the edges of the drawn triangles, whose vertices are on pixels.
+    """
+    ys, xs = np.mgrid[y0: y1, x0: x1]
+    offsets = np.array([[[0.7, 0.2], [0.9, 0.4]], [[0.2, 0.7], [0.4, 0.9]]])
+    return np.stack([xs, ys], axis=-1)[:, :, None, None, :] + offsets
+
+
+def in_triangles(points, triangles):
+    """Return the bool array which is True for the points inside any of the
+       triangles, edges included.
+    Args:
+        points (numpy.ndarray): (n, 2) x and y.
+        triangles (numpy.ndarray): (m, 3, 2) x and y of the vertices.
+    """
+    p = points[:, None, :]
+    a, b, c = (triangles[None, :, i, :] for i in range(3))
+
+    def side(u, v):
+        return (v[..., 0] - u[..., 0]) * (p[..., 1] - u[..., 1]) - (v[..., 1] - u[..., 1]) * (p[..., 0] - u[..., 0])
+
+    d = np.stack([side(a, b), side(b, c), side(c, a)])
+    return (~((d < 0).any(axis=0) & (d > 0).any(axis=0))).any(axis=1)
+
+
+def block_cut(block_np, x0, y0, x1, y1):
+    """Return the bool array indexed by [y - y0, x - x0, triangle] which is
+       True for the triangles of make_collision_shape in the cells
+       [x0, x1) x [y0, y1) of the block not covered by its drawn triangles
+       at all. The drawn triangles of GeoMipTerrain span several pixels, so
+       the collision shapes follow them, instead of judging the holes again
+       at 1 pixel.
+    """
+    *_, points = get_triangles(block_np)
+    samples = fine_samples(x0, y0, x1, y1)
+    covered = in_triangles(samples.reshape(-1, 2), points)
+    return ~covered.reshape(samples.shape[:4]).any(axis=-1)
+
+
+def cut_cells(cut, mask, cell_size, x0, y0, x1, y1):
+    """Cut the triangles of make_collision_shape in the cells of cell_size
+       pixels having holes, for the cells having the pixels [x0, x1] x [y0, y1].
+       The cells are those sampled by terrain_discard_f.glsl.
+    """
+    cx0, cy0, cx1, cy1 = cell_range(mask.shape, cell_size, x0, y0, x1, y1)
+    cells = hole_cells(mask, cell_size, cx0, cy0, cx1, cy1)
+    cells = cells.repeat(cell_size, axis=0).repeat(cell_size, axis=1)
+
+    px0, py0 = cx0 * cell_size, cy0 * cell_size
+    region = cut[py0: (cy1 + 1) * cell_size, px0: (cx1 + 1) * cell_size]
+    region[:] = cells[:region.shape[0], :region.shape[1], None]
+
+
+def cut_from_mask(mask, cell_size=1):
+    """Return the cut of make_collision_shape made from the hole mask by cut_cells.
+    """
+    rows, cols = mask.shape
+    cut = np.zeros((rows - 1, cols - 1, 2), dtype=bool)
+    cut_cells(cut, mask, cell_size, 0, 0, cols - 1, rows - 1)
+    return cut
+
+
+def make_collision_shape(heights, cut, x0, y0, x1, y1, height):
+    """Make the triangle mesh shape of the cells [x0, x1) x [y0, y1) without
+       the cut triangles. The positions are relative to the center of
+       the terrain like BulletHeightfieldShape. Return None if all the
+       triangles are on holes.
+    """
+    rows, cols = heights.shape
+    x1 = min(x1, cols - 1)
+    y1 = min(y1, rows - 1)
+
+    ys, xs = np.mgrid[y0: y1 + 1, x0: x1 + 1]
+    w = x1 - x0 + 1
+    points = np.stack([
+        xs.ravel() - (cols - 1) / 2,
+        ys.ravel() - (rows - 1) / 2,
+        heights[y0: y1 + 1, x0: x1 + 1].ravel() * height - height / 2
+    ], axis=1).astype(np.float32)
+
+    # Two triangles per cell, counterclockwise from above.
+    i = (ys[:-1, :-1] - y0) * w + (xs[:-1, :-1] - x0)
+    i = i.ravel()
+    tris = np.concatenate([
+        np.stack([i, i + 1, i + w + 1], axis=1),
+        np.stack([i, i + w + 1, i + w], axis=1),
+    ])
+    region = cut[y0: y1, x0: x1]
+    if not (tris := tris[~np.concatenate([region[..., 0].ravel(), region[..., 1].ravel()])]).size:
+        return None
+
+    pta_points = PTA_LVecBase3f.empty_array(len(points))
+    np.frombuffer(memoryview(pta_points), dtype=np.float32)[:] = points.ravel()
+    pta_indices = PTA_int.empty_array(tris.size)
+    np.frombuffer(memoryview(pta_indices), dtype=np.int32)[:] = tris.ravel()
+
+    mesh = BulletTriangleMesh()
+    mesh.add_array(pta_points, pta_indices)
+    return BulletTriangleMeshShape(mesh, dynamic=False)
+
+
+def zero_vertices(block_np):
+    """Collapse the block by zero-filling its vertex data in place.
+    """
+    geom = block_np.node().modify_geom(0)
+    v_array = geom.modify_vertex_data().modify_array(0)
+    np.frombuffer(memoryview(v_array), dtype=np.uint8).fill(0)
+
+
+class HoleRegistry:
+    """Record the blocks having holes, to patch them again after
+       GeoMipTerrain regenerated them for the level of detail. A regenerated
+       block gets a new GeomNode, so only the blocks whose node changed are
+       patched.
+    Args:
+        mask (numpy.ndarray): hole mask indexed by [y, x], used for the
+                              blocks in which only triangles are dropped.
+        cell_size (int): the size of the cells of the triangles at the min level.
+    """
+
+    def __init__(self, mask, cell_size=1):
+        self.mask = mask
+        self.cell_size = cell_size
+        # {(mx, my): GeomNode patched last}
+        self.hidden = {}
+        self.punched = {}
+        # The triangles of the collision shapes under the dropped triangles,
+        # indexed by [y, x, triangle] like make_collision_shape.
+        rows, cols = mask.shape
+        self.cut = np.zeros((rows - 1, cols - 1, 2), dtype=bool)
+        # The blocks whose cut changed since the collision shapes were updated.
+        self.dirty = set()
+
+    def hide(self, terrain, mx, my):
+        block_np = terrain.get_block_node_path(mx, my)
+        zero_vertices(block_np)
+        self.hidden[(mx, my)] = block_np.node()
+        self.punched.pop((mx, my), None)
+
+    def punch(self, terrain, mx, my):
+        # The triangles of a hidden block are already invisible.
+        if (mx, my) in self.hidden:
+            return
+
+        block_np = terrain.get_block_node_path(mx, my)
+        drop_triangles(block_np, self.mask, self.cell_size)
+        self.punched[(mx, my)] = block_np.node()
+
+        # The level of detail changes the drawn triangles, and so the cut.
+        # The cells are taken from the block position, not from the vertices.
+        size = terrain.get_block_size()
+        rows, cols = self.cut.shape[:2]
+        x0, y0 = mx * size, my * size
+        x1, y1 = min(x0 + size, cols), min(y0 + size, rows)
+        cut = block_cut(block_np, x0, y0, x1, y1)
+
+        if not np.array_equal(region := self.cut[y0: y1, x0: x1], cut):
+            region[:] = cut
+            self.dirty.add((mx, my))
+
+    def take_dirty(self):
+        """Return the blocks whose cut changed, and clear them.
+        """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def reapply(self, terrain):
+        """Patch the registered blocks which were regenerated.
+           Return the number of the patched blocks.
+        """
+        patched = 0
+
+        for blocks, patch in ((self.hidden, self.hide), (self.punched, self.punch)):
+            for (mx, my), node in list(blocks.items()):
+                if terrain.get_block_node_path(mx, my).node() != node:
+                    patch(terrain, mx, my)
+                    patched += 1
+
+        return patched
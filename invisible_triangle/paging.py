@@ -0,0 +1,221 @@
+import math
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from panda3d.bullet import BulletHeightfieldShape, BulletRigidBodyNode, ZUp
+from panda3d.core import Filename, PNMImage, Texture
+from panda3d.core import NodePath, GeoMipTerrain, BitMask32, Vec3
+
+from holes import get_ram_array
+
+
+def read_heightmap(file_path):
+    """Return the heightmap as uint8 or uint16 array indexed by [y, x] of the
+       terrain, starting from the bottom row. .npy files are memory-mapped,
+       so that only the rows of the loaded tiles are read; the first channel
+       is used if the array has channels, like BGRA output by image_editor.
+    """
+    if pathlib.Path(file_path).suffix.lower() == '.npy':
+        arr = np.load(file_path, mmap_mode='r')
+        if arr.ndim == 3:
+            arr = arr[..., 0]
+        return arr[::-1]
+
+    img = PNMImage(Filename(file_path))
+    if not img.is_valid():
+        raise ValueError(f"Can't open/read file: {file_path}")
+
+    return get_ram_array(img, 'G')
+
+
+def to_pnm(heights):
+    """Make the grayscale PNMImage from the array indexed by [y, x] of the terrain.
+    """
+    rows, cols = heights.shape
+    component = Texture.T_unsigned_short if heights.dtype == np.uint16 else Texture.T_unsigned_byte
+    tex = Texture()
+    tex.setup_2d_texture(cols, rows, component, Texture.F_luminance)
+    # The ram image of Texture starts from the bottom row, like the array.
+    tex.set_ram_image(np.ascontiguousarray(heights).tobytes())
+
+    img = PNMImage()
+    tex.store(img)
+    return img
+
+
+def make_heightfield_shape(heights, height):
+    """Make the centered BulletHeightfieldShape from the uint8 or uint16 array
+       indexed by [y, x] of the terrain.
+    """
+    shape = BulletHeightfieldShape(to_pnm(heights), height, ZUp)
+    shape.set_use_diamond_subdivision(True)
+    return shape
+
+
+class Tile(NamedTuple):
+
+    node: NodePath
+    terrain: GeoMipTerrain
+
+
+class TerrainPager:
+    """Split the heightmap into tiles, each of which has its own GeoMipTerrain
+       and collision shape, and load only the tiles around the focal point.
+       Only the heightmaps of the tiles are cut out on a background thread.
+       GeoMipTerrain and the Bullet shapes must not be made while the main
+       thread renders, so the tiles are built and attached to the scene graph
+       and the Bullet world in update, which is called every frame, at most
+       builds_per_frame tiles in a frame.
+    Args:
+        heights (numpy.ndarray): heightmap returned by read_heightmap.
+        world (BulletWorld): the world to which the collision shapes are attached.
+        height (float): the height of the terrain.
+        tile_size (int): the number of cells of a tile along each side; power of two.
+        radius (int): the tiles within radius from the tile under the focal point are loaded.
+                      The tiles farther than radius + 1 are unloaded.
+        builds_per_frame (int): the number of tiles built in a frame at most.
+    """
+
+    def __init__(self, heights, world, height=50, tile_size=128, radius=2, block_size=8, min_level=2,
+                 builds_per_frame=1):
+        self.heights = heights
+        self.world = world
+        self.height = height
+        self.tile_size = tile_size
+        self.radius = radius
+        self.block_size = block_size
+        self.min_level = min_level
+        self.builds_per_frame = builds_per_frame
+
+        rows, cols = heights.shape
+        self.center = ((cols - 1) / 2, (rows - 1) / 2)
+        self.num_tiles = (math.ceil((cols - 1) / tile_size), math.ceil((rows - 1) / tile_size))
+
+        self.root = NodePath('paged_terrain')
+        self.focal_point = None
+        self.tiles = {}
+        self.pending = {}
+        # {(tx, ty): PNMImage} read but not built yet.
+        self.ready = {}
+        # The tiles which failed to be read are not requested again.
+        self.failed = set()
+        self.errors = []
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def read_tile(self, tx, ty):
+        """Return the heightmap of the tile (tx, ty) as PNMImage. Called on the
+           background thread.
+        """
+        size = self.tile_size
+        x0, y0 = tx * size, ty * size
+        heights = self.heights[y0: y0 + size + 1, x0: x0 + size + 1]
+
+        # GeoMipTerrain needs the size of power of two plus one, so the edge
+        # tiles are padded by repeating the last row and column.
+        if heights.shape != (size + 1, size + 1):
+            heights = np.pad(
+                heights, ((0, size + 1 - heights.shape[0]), (0, size + 1 - heights.shape[1])), mode='edge')
+
+        return to_pnm(heights)
+
+    def build_tile(self, tx, ty, img):
+        """Make the tile (tx, ty) from its heightmap without attaching it.
+           Called on the main thread.
+        """
+        size = self.tile_size
+        x0, y0 = tx * size, ty * size
+        shape = BulletHeightfieldShape(img, self.height, ZUp)
+        shape.set_use_diamond_subdivision(True)
+
+        node = NodePath(BulletRigidBodyNode(f'tile{tx}x{ty}'))
+        node.node().set_mass(0)
+        node.node().add_shape(shape)
+        node.set_collide_mask(BitMask32.bit(1))
+        # BulletHeightfieldShape is centered.
+        node.set_pos(x0 + size / 2 - self.center[0], y0 + size / 2 - self.center[1], 0)
+
+        terrain = GeoMipTerrain(f'geomip_terrain{tx}x{ty}')
+        terrain.set_heightfield(img)
+        terrain.set_border_stitching(True)
+        terrain.set_block_size(self.block_size)
+        terrain.set_min_level(self.min_level)
+        terrain.set_focal_point(self.focal_point)
+
+        terrain_root = terrain.get_root()
+        terrain_root.set_scale(Vec3(1, 1, self.height))
+        terrain_root.set_pos(-size / 2, -size / 2, -self.height / 2)
+        terrain.generate()
+        terrain_root.reparent_to(node)
+
+        return Tile(node, terrain)
+
+    def get_tile_pos(self, focal_point):
+        pos = focal_point.get_pos(self.root)
+        return (int((pos.x + self.center[0]) // self.tile_size),
+                int((pos.y + self.center[1]) // self.tile_size))
+
+    def take_errors(self):
+        """Return the messages of the tiles which failed to be read, and clear them.
+        """
+        errors, self.errors = self.errors, []
+        return errors
+
+    def update(self, focal_point):
+        """Build and attach the read tiles, request the tiles around the focal
+           point from nearer ones, and unload the far tiles. Return the numbers
+           of the loaded and pending tiles.
+        """
+        self.focal_point = focal_point
+        fx, fy = self.get_tile_pos(focal_point)
+        nx, ny = self.num_tiles
+
+        def distance(key):
+            return max(abs(key[0] - fx), abs(key[1] - fy))
+
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                try:
+                    self.ready[key] = future.result()
+                except Exception as e:
+                    self.failed.add(key)
+                    self.errors.append(f'tile {key}: {e}')
+
+        for key in [key for key in self.ready if distance(key) > self.radius + 1]:
+            del self.ready[key]
+
+        # The nearest tiles are built first.
+        for key in sorted(self.ready, key=distance)[:self.builds_per_frame]:
+            tile = self.build_tile(*key, self.ready.pop(key))
+            tile.node.reparent_to(self.root)
+            self.world.attach(tile.node.node())
+            self.tiles[key] = tile
+
+        for key in [key for key in self.tiles if distance(key) > self.radius + 1]:
+            tile = self.tiles.pop(key)
+            self.world.remove(tile.node.node())
+            tile.node.remove_node()
+
+        for key in [key for key in self.pending if distance(key) > self.radius + 1]:
+            if self.pending[key].cancel():
+                del self.pending[key]
+
+        wanted = [
+            (tx, ty)
+            for tx in range(max(fx - self.radius, 0), min(fx + self.radius + 1, nx))
+            for ty in range(max(fy - self.radius, 0), min(fy + self.radius + 1, ny))
+        ]
+
+        for key in sorted(wanted, key=distance):
+            if not any(key in known for known in (self.tiles, self.pending, self.ready, self.failed)):
+                self.pending[key] = self.executor.submit(self.read_tile, *key)
+
+        for tile in self.tiles.values():
+            tile.terrain.update()
+
+        return len(self.tiles), len(self.pending) + len(self.ready)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
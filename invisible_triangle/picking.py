@@ -0,0 +1,134 @@
+import numpy as np
+
+
+def intersect_triangle(origin, direction, a, b, c):
+    """Return the parameter t at which the ray hits the triangle, or None.
+       (Moller-Trumbore)
+    """
+    e1 = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+    e2 = (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+    dx, dy, dz = direction
+    p = (dy * e2[2] - dz * e2[1], dz * e2[0] - dx * e2[2], dx * e2[1] - dy * e2[0])
+
+    if (det := e1[0] * p[0] + e1[1] * p[1] + e1[2] * p[2]) == 0:
+        return None
+
+    s = (origin[0] - a[0], origin[1] - a[1], origin[2] - a[2])
+    if not 0 <= (u := (s[0] * p[0] + s[1] * p[1] + s[2] * p[2]) / det) <= 1:
+        return None
+
+    q = (s[1] * e1[2] - s[2] * e1[1], s[2] * e1[0] - s[0] * e1[2], s[0] * e1[1] - s[1] * e1[0])
+    if (v := (dx * q[0] + dy * q[1] + dz * q[2]) / det) < 0 or u + v > 1:
+        return None
+
+    return (e2[0] * q[0] + e2[1] * q[1] + e2[2] * q[2]) / det
+
+
+class HeightQuadtree:
+    """Quadtree of the minimum and maximum heights of the cells of the
+       heightfield, to intersect a ray with the terrain without Bullet.
+       The nodes are visited from near to far, and the nodes farther than
+       the nearest hit so far are skipped. The coordinates are those of
+       GeoMipTerrain before scaling: x and y in pixels, and z from 0 to 1.
+    Args:
+        heights (numpy.ndarray): elevations from 0 to 1 indexed by [y, x].
+        cut (numpy.ndarray): the cut triangles indexed by [y, x, triangle]
+                             like make_collision_shape; they are not hit.
+                             Changes are reflected at once.
+    """
+
+    def __init__(self, heights, cut=None):
+        self.heights = h = heights.astype(np.float32, copy=False)
+        self.cut = cut
+
+        rows, cols = h.shape[0] - 1, h.shape[1] - 1
+        n = 1 << int(max(rows, cols) - 1).bit_length()
+
+        # The padded cells are empty: their minimum is above the maximum.
+        lo = np.full((n, n), np.inf, dtype=np.float32)
+        hi = np.full((n, n), -np.inf, dtype=np.float32)
+        corners = (h[:-1, :-1], h[:-1, 1:], h[1:, :-1], h[1:, 1:])
+        np.minimum(np.minimum(corners[0], corners[1]), np.minimum(corners[2], corners[3]), out=lo[:rows, :cols])
+        np.maximum(np.maximum(corners[0], corners[1]), np.maximum(corners[2], corners[3]), out=hi[:rows, :cols])
+
+        # levels[0] is the cells, and levels[-1] is the root. The elements
+        # are read with item, which is faster than indexing for one value.
+        self.levels = [(lo, hi)]
+
+        while n > 1:
+            n //= 2
+            lo = lo.reshape(n, 2, n, 2).min(axis=(1, 3))
+            hi = hi.reshape(n, 2, n, 2).max(axis=(1, 3))
+            self.levels.append((lo, hi))
+
+    def pick(self, origin, direction):
+        """Return the point where the segment from origin to origin + direction
+           hits the terrain first, or None.
+        """
+        ox, oy, oz = origin = tuple(float(v) for v in origin)
+        # Zero is replaced so that the slabs parallel to the ray need no special case.
+        direction = tuple(float(v) or 1e-12 for v in direction)
+        ix, iy, iz = (1 / v for v in direction)
+        nearest = 1.0
+        hit = False
+
+        def enter(level, x, y):
+            """Return the parameter t at which the segment enters the node, or None.
+            """
+            lo, hi = self.levels[level]
+            if (z0 := lo.item(y, x)) > (z1 := hi.item(y, x)):
+                return None
+
+            size = 1 << level
+            tx0, tx1 = (x * size - ox) * ix, ((x + 1) * size - ox) * ix
+            ty0, ty1 = (y * size - oy) * iy, ((y + 1) * size - oy) * iy
+            tz0, tz1 = (z0 - oz) * iz, (z1 - oz) * iz
+            t_near = max(min(tx0, tx1), min(ty0, ty1), min(tz0, tz1), 0)
+            t_far = min(max(tx0, tx1), max(ty0, ty1), max(tz0, tz1))
+
+            if t_near <= t_far and t_near <= nearest:
+                return t_near
+
+        top = len(self.levels) - 1
+        stack = [(t, top, 0, 0)] if (t := enter(top, 0, 0)) is not None else []
+
+        while stack:
+            t, level, x, y = stack.pop()
+            if t > nearest:
+                continue
+
+            if level == 0:
+                if (t := self.intersect_cell(x, y, origin, direction)) is not None and t <= nearest:
+                    nearest = t
+                    hit = True
+                continue
+
+            children = []
+            for cx, cy in ((2 * x, 2 * y), (2 * x + 1, 2 * y), (2 * x, 2 * y + 1), (2 * x + 1, 2 * y + 1)):
+                if (t := enter(level - 1, cx, cy)) is not None:
+                    children.append((t, level - 1, cx, cy))
+
+            # The nearest child is popped first.
+            stack.extend(sorted(children, reverse=True))
+
+        if hit:
+            return np.array(origin) + np.array(direction) * nearest
+
+    def intersect_cell(self, x, y, origin, direction):
+        """Intersect the ray with the two triangles of the cell, made in the
+           same way as make_collision_shape. Return the nearest t or None.
+        """
+        h = self.heights
+        p00 = (x, y, h.item(y, x))
+        p10 = (x + 1, y, h.item(y, x + 1))
+        p11 = (x + 1, y + 1, h.item(y + 1, x + 1))
+        p01 = (x, y + 1, h.item(y + 1, x))
+        found = []
+
+        for i, tri in enumerate(((p00, p10, p11), (p00, p11, p01))):
+            if self.cut is not None and self.cut.item(y, x, i):
+                continue
+            if (t := intersect_triangle(origin, direction, *tri)) is not None and 0 <= t <= 1:
+                found.append(t)
+
+        return min(found, default=None)
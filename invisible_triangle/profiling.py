@@ -0,0 +1,83 @@
+import csv
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+
+class Stage:
+    """Context manager measuring the elapsed time of a stage. The latest
+       samples are kept for the rolling percentiles.
+    Args:
+        window (int): the number of the latest samples kept.
+    """
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.samples.append(elapsed)
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def percentiles(self):
+        """Return p50 and p99 of the latest samples in seconds.
+        """
+        if not self.samples:
+            return float('nan'), float('nan')
+        return tuple(np.percentile(self.samples, [50, 99]))
+
+
+class Profiler:
+    """Measure the stages of a frame by name. If disabled, measure returns
+       a context manager doing nothing.
+    Args:
+        enabled (bool): whether to measure.
+        window (int): the number of the latest samples used for the percentiles.
+    """
+
+    def __init__(self, enabled=True, window=300):
+        self.enabled = enabled
+        self.window = window
+        self.stages = {}
+        self.null = nullcontext()
+
+    def measure(self, name):
+        if not self.enabled:
+            return self.null
+
+        if (stage := self.stages.get(name)) is None:
+            stage = self.stages[name] = Stage(self.window)
+        return stage
+
+    def summary(self, name):
+        if (stage := self.stages.get(name)) is None:
+            return f'{name}: -'
+
+        p50, p99 = stage.percentiles()
+        return f'{name} p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms'
+
+    def write_csv(self, file_path):
+        """Write the rolling p50 and p99, and the mean and max of all the samples
+           of each stage in milliseconds.
+        """
+        with open(file_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'count', 'p50_ms', 'p99_ms', 'mean_ms', 'max_ms'])
+
+            for name, stage in self.stages.items():
+                p50, p99 = stage.percentiles()
+                writer.writerow([
+                    name, stage.count, f'{p50 * 1000:.4f}', f'{p99 * 1000:.4f}',
+                    f'{stage.total / stage.count * 1000:.4f}', f'{stage.max * 1000:.4f}'])